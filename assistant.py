@@ -0,0 +1,356 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, deque
+
+# AI RESPONSES
+#
+# Helpers for /ai: a limiter for how many completions run at once, and a reply
+# that streams a completion into Discord messages. Edits are throttled to one
+# per `interval` and long replies continue in a new message instead of being
+# cut off at the embed limit.
+
+EMBED_LIMIT = 4096
+
+
+class InFlightLimiter:
+    def __init__(self, per_user=1, total=8, max_waiting=32):
+        self.per_user = per_user
+        self.max_waiting = max_waiting
+        self._semaphore = asyncio.Semaphore(total)
+        self._users = {}  # user_id -> requests in flight or waiting
+        self._waiting = 0
+
+    def acquire(self, user_id):
+        # Returns a slot to use with `async with`, or None if the user or the bot is at its limit
+        if self._users.get(user_id, 0) >= self.per_user or self._waiting >= self.max_waiting:
+            return None
+        self._users[user_id] = self._users.get(user_id, 0) + 1
+        return _Slot(self, user_id)
+
+    def _release_user(self, user_id):
+        remaining = self._users[user_id] - 1
+        if remaining:
+            self._users[user_id] = remaining
+        else:
+            del self._users[user_id]
+
+    @property
+    def in_flight(self):
+        return sum(self._users.values())
+
+
+class _Slot:
+    # Holds the user's place while the `async with` block runs, wait() also takes one of the global places
+    def __init__(self, limiter, user_id):
+        self.limiter = limiter
+        self.user_id = user_id
+        self._acquired = False
+
+    async def __aenter__(self):
+        return self
+
+    async def wait(self):
+        if self._acquired:
+            return
+        limiter = self.limiter
+        limiter._waiting += 1
+        try:
+            await limiter._semaphore.acquire()
+            self._acquired = True
+        finally:
+            limiter._waiting -= 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._acquired:
+            self.limiter._semaphore.release()
+        self.limiter._release_user(self.user_id)
+
+
+def split_text(text, limit=EMBED_LIMIT):
+    # Splits at the last line break or space before the limit, if there is one in the second half
+    if len(text) <= limit:
+        return text, ''
+    cut = text.rfind('\n', limit // 2, limit)
+    if cut == -1:
+        cut = text.rfind(' ', limit // 2, limit)
+    if cut == -1:
+        cut = limit
+    return text[:cut], text[cut:].lstrip()
+
+
+class StreamingReply:
+    def __init__(self, followup, render, interval=1.0, limit=EMBED_LIMIT):
+        self.followup = followup  # interaction.followup
+        self.render = render  # text -> keyword arguments for send()/edit(), e.g. {'embed': ...}
+        self.interval = interval
+        self.limit = limit
+        self.messages = []
+        self._chunks = []
+        self._current = None  # message that is still being written
+        self._text = ''  # text of the current message
+        self._shown = ''  # what the current message shows right now
+        self._last_edit = 0.0
+
+    @property
+    def text(self):
+        # The whole reply so far, across all messages
+        return ''.join(self._chunks)
+
+    async def append(self, chunk):
+        self._chunks.append(chunk)
+        self._text += chunk
+        # Fill up and finish the current message, then continue in a new one
+        while len(self._text) > self.limit:
+            head, self._text = split_text(self._text, self.limit)
+            await self._show(head)
+            self._current = None
+            self._shown = ''
+        if time.monotonic() - self._last_edit >= self.interval:
+            await self._show(self._text)
+
+    async def finish(self, empty='(empty response)'):
+        if not self._text and not self.messages:
+            self._text = empty
+        await self._show(self._text)
+        return self.messages
+
+    async def _show(self, text):
+        if not text or text == self._shown:
+            return
+        if self._current is None:
+            self._current = await self.followup.send(**self.render(text), wait=True)
+            self.messages.append(self._current)
+        else:
+            await self._current.edit(**self.render(text))
+        self._shown = text
+        self._last_edit = time.monotonic()
+
+
+# RESPONSE CACHE
+#
+# Answers to prompts that were asked before, keyed by model and the prompt with
+# case and whitespace normalized. Least recently used entries are evicted past
+# `max_entries` and every entry expires `ttl` seconds after it was stored.
+# With a `path` the cache is saved to disk and loaded again on startup.
+
+
+def normalize_prompt(prompt):
+    return ' '.join(prompt.lower().split())
+
+
+class ResponseCache:
+    def __init__(self, max_entries=1000, ttl=86400, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (model, prompt) -> (expires_at, response)
+        self._changed = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, model, prompt):
+        key = (model, normalize_prompt(prompt))
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.time():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, model, prompt, response):
+        key = (model, normalize_prompt(prompt))
+        self._entries[key] = (time.time() + self.ttl, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._changed = True
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    # PERSISTENCE
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # A damaged cache file is not worth failing over, start empty
+            return []
+
+    async def load(self):
+        # The file is read in a thread, the entries are merged on the event loop where get() and put() run
+        if not self.path:
+            return 0
+        rows = await asyncio.to_thread(self._read)
+        now = time.time()
+        # Entries from disk are older than the ones /ai stored meanwhile, those win and stay most recently used
+        entries = OrderedDict()
+        for model, prompt, expires_at, response in rows:
+            if expires_at > now and (model, prompt) not in self._entries:
+                entries[(model, prompt)] = (expires_at, response)
+        entries.update(self._entries)
+        self._entries = entries
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return len(self._entries)
+
+    def _write(self, rows):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    async def save(self):
+        # Only writes when something was added since the last save
+        if not self.path or not self._changed:
+            return False
+        self._changed = False
+        now = time.time()
+        rows = [[model, prompt, expires_at, response] for (model, prompt), (expires_at, response) in self._entries.items() if expires_at > now]
+        await asyncio.to_thread(self._write, rows)
+        return True
+
+
+# CONVERSATION MEMORY
+#
+# Recent turns per channel for channels that turned conversation mode on. Each
+# conversation keeps at most `token_budget` tokens of turns. Turns that fall
+# out of the budget are handed to `summarize` in the background and folded into
+# a short summary, or just dropped without it. Conversations nobody used for
+# `idle_timeout` seconds are forgotten.
+
+
+def estimate_tokens(text):
+    # About four characters per token for English text, close enough for a budget
+    return len(text) // 4 + 4
+
+
+class Conversation:
+    __slots__ = ('turns', 'tokens', 'summary', 'dropped', 'summarizing', 'last_used')
+
+    def __init__(self):
+        self.turns = deque()  # (role, content, tokens)
+        self.tokens = 0
+        self.summary = ''
+        self.dropped = []  # turns waiting to be summarized
+        self.summarizing = None
+        self.last_used = time.monotonic()
+
+
+class ConversationMemory:
+    def __init__(self, token_budget=2000, summary_tokens=300, idle_timeout=1800, max_conversations=5000, summarize=None, logger=None):
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.idle_timeout = idle_timeout
+        self.max_conversations = max_conversations
+        self.summarize = summarize  # async (summary, [(role, content)], max_tokens) -> new summary, None to try again later
+        self.logger = logger
+        self._conversations = OrderedDict()  # channel_id -> Conversation, least recently used first
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def _get(self, channel_id, create=False):
+        self.prune()
+        conversation = self._conversations.get(channel_id)
+        if conversation is None and create:
+            conversation = self._conversations[channel_id] = Conversation()
+            while len(self._conversations) > self.max_conversations:
+                self._forget(next(iter(self._conversations)))
+        if conversation is not None:
+            conversation.last_used = time.monotonic()
+            self._conversations.move_to_end(channel_id)
+        return conversation
+
+    def messages(self, channel_id, prompt):
+        # The messages to send for a new prompt in the channel
+        messages = []
+        conversation = self._get(channel_id)
+        if conversation is not None:
+            if conversation.summary:
+                messages.append({'role': 'system', 'content': f'Summary of the earlier conversation: {conversation.summary}'})
+            messages.extend({'role': role, 'content': content} for role, content, _ in conversation.turns)
+        messages.append({'role': 'user', 'content': prompt})
+        return messages
+
+    def add(self, channel_id, prompt, response):
+        conversation = self._get(channel_id, create=True)
+        for role, content in (('user', prompt), ('assistant', response)):
+            tokens = estimate_tokens(content)
+            conversation.turns.append((role, content, tokens))
+            conversation.tokens += tokens
+        # Oldest turns go first, but the newest exchange always stays
+        while conversation.tokens > self.token_budget and len(conversation.turns) > 2:
+            role, content, tokens = conversation.turns.popleft()
+            conversation.tokens -= tokens
+            if self.summarize is not None:
+                conversation.dropped.append((role, content))
+        self._trim_dropped(conversation)
+        if conversation.dropped and conversation.summarizing is None:
+            conversation.summarizing = asyncio.ensure_future(self._summarize(conversation))
+
+    async def _summarize(self, conversation):
+        try:
+            while conversation.dropped:
+                dropped, conversation.dropped = conversation.dropped, []
+                summary = await self.summarize(conversation.summary, dropped, self.summary_tokens)
+                if summary is None:
+                    # Couldn't run now, the turns are summarized with the next ones
+                    conversation.dropped = dropped + conversation.dropped
+                    self._trim_dropped(conversation)
+                    break
+                conversation.summary = summary
+        except Exception as e:
+            # Keep going with the old summary, the dropped turns are lost
+            conversation.dropped = []
+            if self.logger:
+                self.logger.error(f'Failed to summarize conversation: {e}')
+        finally:
+            conversation.summarizing = None
+
+    def _trim_dropped(self, conversation):
+        # Turns waiting for a summary are kept to token_budget too, the oldest go first
+        tokens = 0
+        for index in range(len(conversation.dropped) - 1, -1, -1):
+            tokens += estimate_tokens(conversation.dropped[index][1])
+            if tokens > self.token_budget:
+                del conversation.dropped[:index + 1]
+                return
+
+    def clear(self, channel_id):
+        return self._forget(channel_id)
+
+    def _forget(self, channel_id):
+        conversation = self._conversations.pop(channel_id, None)
+        if conversation is None:
+            return False
+        if conversation.summarizing is not None:
+            conversation.summarizing.cancel()
+        return True
+
+    def prune(self):
+        # Idle conversations are at the front
+        expired = time.monotonic() - self.idle_timeout
+        while self._conversations:
+            channel_id, conversation = next(iter(self._conversations.items()))
+            if conversation.last_used > expired:
+                break
+            self._forget(channel_id)
@@ -0,0 +1,72 @@
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wordfilter import BannedWordMatcher
+
+# BANNED WORD FILTER BENCHMARK
+#
+# Compares the old on_message loop (word.lower() in message for every word)
+# against the compiled matcher. Run with: python benchmarks/bench_filter.py
+
+MESSAGE_COUNT = 2000
+WORD_LIST_SIZES = [500, 10000, 50000]
+
+
+def random_word(rng, min_len=4, max_len=12):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(min_len, max_len)))
+
+
+def make_messages(rng, words, count):
+    messages = []
+    for i in range(count):
+        parts = [random_word(rng, 2, 9) for _ in range(rng.randint(5, 25))]
+        # Roughly one in twenty messages contains a banned word
+        if i % 20 == 0:
+            parts.insert(rng.randrange(len(parts)), rng.choice(words).upper())
+        messages.append(' '.join(parts))
+    return messages
+
+
+def naive_filter(words, content):
+    msg_content = content.lower()
+    for word in words:
+        if word.lower() in msg_content:
+            return word
+    return None
+
+
+def run(label, fn, messages):
+    hits = 0
+    start = time.perf_counter()
+    for content in messages:
+        if fn(content) is not None:
+            hits += 1
+    elapsed = time.perf_counter() - start
+    rate = len(messages) / elapsed
+    print(f'  {label:<10} {rate:>12,.0f} msg/s  ({hits} hits)')
+    return rate
+
+
+def main():
+    rng = random.Random(1234)
+    for size in WORD_LIST_SIZES:
+        words = list({random_word(rng) for _ in range(size)})
+        messages = make_messages(rng, words, MESSAGE_COUNT)
+
+        start = time.perf_counter()
+        matcher = BannedWordMatcher(words)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        print(f'{len(words)} words, {matcher.state_count} states, compiled in {build_ms:.1f} ms')
+        naive_rate = run('naive', lambda c: naive_filter(words, c), messages)
+        matcher_rate = run('matcher', matcher.search, messages)
+        print(f'  speedup    {matcher_rate / naive_rate:>12.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from radio import ffmpeg_args, probe_codec, PASSTHROUGH_CODECS
+
+# OPUS PASSTHROUGH BENCHMARK
+#
+# Runs each sample file through the station pipeline twice, once transcoded
+# to Opus (how every station used to be played) and once with the codec the
+# hub picks after probing, and reports FFmpeg CPU time per minute of audio.
+# Needs ffmpeg on PATH (or --ffmpeg). Sample files are generated if no
+# --files are given. Run with: python benchmarks/bench_passthrough.py
+
+SAMPLES = [
+    ('opus.ogg', ['-c:a', 'libopus', '-b:a', '128k']),
+    ('opus.webm', ['-c:a', 'libopus', '-b:a', '128k']),
+    ('stream.aac', ['-c:a', 'aac', '-b:a', '128k']),
+    ('stream.mp3', ['-c:a', 'libmp3lame', '-b:a', '128k']),
+]
+
+
+def make_samples(ffmpeg, directory, seconds):
+    paths = []
+    for name, codec_args in SAMPLES:
+        path = os.path.join(directory, name)
+        subprocess.run([
+            ffmpeg, '-y', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={seconds}',
+            '-f', 'lavfi', '-i', f'anoisesrc=color=pink:sample_rate=48000:amplitude=0.1:duration={seconds}',
+            '-filter_complex', '[0:a][1:a]amerge=inputs=2[a]', '-map', '[a]',
+            *codec_args, path
+        ], check=True)
+        paths.append(path)
+    return paths
+
+
+def cpu_seconds(args, runs=3):
+    # Fastest of a few runs, FFmpeg's CPU time only
+    best = None
+    for _ in range(runs):
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        used = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+        best = used if best is None else min(best, used)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', nargs='*', help='local sample files, generated if not given')
+    parser.add_argument('--seconds', type=int, default=60, help='length of generated samples')
+    parser.add_argument('--ffmpeg', default=shutil.which('ffmpeg') or 'ffmpeg')
+    options = parser.parse_args()
+
+    if not shutil.which(options.ffmpeg):
+        print(f'ffmpeg not found ({options.ffmpeg}), install it or pass --ffmpeg')
+        return 1
+
+    files = options.files or make_samples(options.ffmpeg, tempfile.mkdtemp(), options.seconds)
+    print(f'{"file":<12} {"codec":<7} {"mode":<9} {"transcode":>12} {"hub":>12} {"saved":>7}')
+    for path in files:
+        codec = probe_codec(path, options.ffmpeg)
+        duration = options.seconds if not options.files else None
+        if duration is None:
+            # Decode once to find the length of a file we didn't make
+            result = subprocess.run([options.ffmpeg, '-hide_banner', '-i', path, '-f', 'null', '-'], stderr=subprocess.PIPE, stdout=subprocess.DEVNULL)
+            time_field = result.stderr.decode('utf-8', 'replace').rsplit('time=', 1)[-1].split()[0]
+            hours, minutes, seconds = time_field.split(':')
+            duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+        transcode = cpu_seconds(ffmpeg_args(path, codec='libopus', executable=options.ffmpeg)) / duration * 60
+        if codec in PASSTHROUGH_CODECS:
+            hub = cpu_seconds(ffmpeg_args(path, codec='copy', executable=options.ffmpeg)) / duration * 60
+            print(
+                f'{os.path.basename(path):<12} {codec:<7} {"copy":<9} '
+                f'{transcode:9.3f} s/m {hub:9.3f} s/m {(1 - hub / transcode) * 100:6.1f}%'
+            )
+        else:
+            # Same command either way
+            print(f'{os.path.basename(path):<12} {codec or "?":<7} {"transcode":<9} {transcode:9.3f} s/m {transcode:9.3f} s/m {"-":>7}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
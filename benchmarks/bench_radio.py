@@ -0,0 +1,154 @@
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+from radio import RadioHub
+
+# RADIO FAN-OUT BENCHMARK
+#
+# Plays the same stream to N simulated listeners two ways and measures CPU and
+# memory:
+#   per-listener: one FFmpegPCMAudio process per voice client (the old /radio),
+#                 plus the Opus encode discord.py does for each of them
+#   hub:          one FFmpeg process for the station, packets fanned out
+# Listeners are driven like discord.py's player: one read() per 20ms frame.
+# Needs ffmpeg on PATH (or --ffmpeg). A test stream file is generated if none
+# is given. Run with: python benchmarks/bench_radio.py --listeners 10
+
+FRAME_SECONDS = 0.02
+PCM_FRAME_SIZE = 3840  # 20ms of 48kHz 16-bit stereo
+
+
+def make_test_stream(ffmpeg, path, seconds):
+    # Stereo AAC in ADTS, like radio.syncwi.de's stream.aac
+    subprocess.run([
+        ffmpeg, '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=44100:duration={seconds}',
+        '-f', 'lavfi', '-i', f'anoisesrc=color=pink:sample_rate=44100:amplitude=0.1:duration={seconds}',
+        '-filter_complex', '[0:a][1:a]amerge=inputs=2[a]', '-map', '[a]',
+        '-c:a', 'aac', '-b:a', '128k', path
+    ], check=True)
+
+
+def rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def load_encoder():
+    try:
+        if not discord.opus.is_loaded():
+            discord.opus._load_default()
+        return discord.opus.Encoder() if discord.opus.is_loaded() else None
+    except Exception:
+        return None
+
+
+def drive(read_frames, seconds, sample_pids):
+    # Calls read_frames() every 20ms, samples memory halfway through
+    frames = int(seconds / FRAME_SECONDS)
+    memory_kb = 0
+    started = time.perf_counter()
+    for i in range(frames):
+        read_frames()
+        if i == frames // 2:
+            memory_kb = sum(rss_kb(pid) for pid in sample_pids())
+        delay = started + (i + 1) * FRAME_SECONDS - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    return memory_kb
+
+
+def run_per_listener(ffmpeg, path, listeners, seconds, encode):
+    args = [ffmpeg, '-re', '-i', path, '-f', 's16le', '-ar', '48000', '-ac', '2', '-loglevel', 'warning', 'pipe:1']
+    encoders = [load_encoder() for _ in range(listeners)] if encode else []
+    cpu_before, self_before = children_cpu(), time.process_time()
+    processes = [subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) for _ in range(listeners)]
+
+    def read_frames():
+        for i, process in enumerate(processes):
+            pcm = process.stdout.read(PCM_FRAME_SIZE)
+            if encoders and len(pcm) == PCM_FRAME_SIZE:
+                encoders[i].encode(pcm, encoders[i].SAMPLES_PER_FRAME)
+
+    memory_kb = drive(read_frames, seconds, lambda: [p.pid for p in processes])
+    for process in processes:
+        process.kill()
+        process.wait()
+    return children_cpu() - cpu_before, time.process_time() - self_before, memory_kb, listeners
+
+
+def run_hub(ffmpeg, path, listeners, seconds):
+    hub = RadioHub(executable=ffmpeg)
+    cpu_before, self_before = children_cpu(), time.process_time()
+    sources = [hub.listen(path, before_options='-re') for _ in range(listeners)]
+    processes = len(hub)
+
+    def read_frames():
+        for source in sources:
+            source.read()
+
+    memory_kb = drive(read_frames, seconds, lambda: [station._process.pid for station in hub._stations.values()])
+    for source in sources:
+        source.cleanup()
+    return children_cpu() - cpu_before, time.process_time() - self_before, memory_kb, processes
+
+
+def report(name, seconds, listeners, result):
+    ffmpeg_cpu, python_cpu, memory_kb, processes = result
+    total = ffmpeg_cpu + python_cpu
+    print(
+        f'{name:<14} {processes:>5} ffmpeg | '
+        f'CPU {total / seconds * 100:6.1f}% total, {total / seconds * 100 / listeners:5.2f}% per listener '
+        f'(ffmpeg {ffmpeg_cpu:.2f}s, python {python_cpu:.2f}s) | '
+        f'ffmpeg RSS {memory_kb / 1024:6.1f} MB total, {memory_kb / 1024 / listeners:5.2f} MB per listener'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--listeners', type=int, default=10)
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--file', help='local test stream, generated if not given')
+    parser.add_argument('--ffmpeg', default=shutil.which('ffmpeg') or 'ffmpeg')
+    options = parser.parse_args()
+
+    if not shutil.which(options.ffmpeg):
+        print(f'ffmpeg not found ({options.ffmpeg}), install it or pass --ffmpeg')
+        return 1
+
+    path = options.file
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'stream.aac')
+        make_test_stream(options.ffmpeg, path, int(options.seconds) + 10)
+
+    encode = load_encoder() is not None
+    print(f'{options.listeners} listeners, {options.seconds:.0f}s of {os.path.basename(path)}')
+    if not encode:
+        print('libopus not found, the per-listener numbers leave out discord.py\'s Opus encode')
+    report('per-listener', options.seconds, options.listeners, run_per_listener(options.ffmpeg, path, options.listeners, options.seconds, encode))
+    report('hub', options.seconds, options.listeners, run_hub(options.ffmpeg, path, options.listeners, options.seconds))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
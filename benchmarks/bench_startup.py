@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# STARTUP BENCHMARK
+#
+# Measures how long a fresh process takes to import main.py and how long
+# on_ready takes, with the gateway, the REST API and MySQL replaced by stubs.
+# Every run starts a new Python process so nothing is cached between runs.
+# Exits with an error when a limit is given and exceeded, so it can guard
+# against startup regressions:
+#   python benchmarks/bench_startup.py --max-import-ms 1500 --max-ready-ms 200
+
+
+# Shared by all runs, so every run after the first finds the commands already synced
+MANIFEST = os.path.join(tempfile.mkdtemp(), 'command_manifest.json')
+
+
+def child_env():
+    env = dict(os.environ)
+    data = tempfile.mkdtemp()
+    env.update({
+        'LEDGER_JOURNAL': os.path.join(data, 'ledger.journal'),
+        'AI_CACHE_PATH': '',
+        'COMMAND_MANIFEST': MANIFEST,
+        'DISCORD_BOT_TOKEN': 'benchmark',
+        'METRICS_PORT': '0',
+    })
+    return env
+
+
+def measure_imports():
+    # -X importtime lists every module with its cumulative import time in microseconds
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        cwd=ROOT, env=child_env(), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True
+    )
+    modules = []
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        name = name[1:]
+        # Direct imports of main.py are indented by exactly two spaces
+        if name.startswith('   ') or not name.startswith('  '):
+            if name.strip() == 'main':
+                total = int(cumulative) / 1000
+            continue
+        modules.append((int(cumulative) / 1000, name.strip()))
+    return total, sorted(modules, reverse=True)
+
+
+async def run_ready():
+    from fakes import FakeDatabase
+    import main
+
+    # Stubs for everything on_ready would talk to
+    fake_db = FakeDatabase()
+    main.db = fake_db
+    main.ledger.db = fake_db
+    main.status_heartbeat.start = lambda: None
+    main.monitor_status.start = lambda: None
+    main.bot._connection.user = SimpleNamespace(name='Nexus', id=1)
+    syncs = []
+
+    async def sync(*args, **kwargs):
+        syncs.append(time.perf_counter())
+        return []
+
+    async def change_presence(*args, **kwargs):
+        pass
+
+    main.tree.sync = sync
+    main.bot.change_presence = change_presence
+
+    started = time.perf_counter()
+    await main.on_ready()
+    ready = time.perf_counter() - started
+
+    # A gateway reconnect fires on_ready again
+    started = time.perf_counter()
+    await main.on_ready()
+    reconnect = time.perf_counter() - started
+    return {'ready_ms': ready * 1000, 'reconnect_ms': reconnect * 1000, 'syncs': len(syncs)}
+
+
+def measure_ready():
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child'],
+        cwd=ROOT, env=child_env(), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+    )
+    timings = json.loads(result.stdout.decode().strip().splitlines()[-1])
+    timings['process_ms'] = (time.perf_counter() - started) * 1000
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--max-import-ms', type=float)
+    parser.add_argument('--max-ready-ms', type=float)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child:
+        timings = asyncio.run(run_ready())
+        print(json.dumps(timings))
+        # Background tasks started by on_ready keep running, there is nothing to clean up for a benchmark
+        os._exit(0)
+
+    imports = [measure_imports() for _ in range(options.runs)]
+    readies = [measure_ready() for _ in range(options.runs)]
+    import_ms = min(total for total, _ in imports)
+    ready = min(readies, key=lambda timings: timings['ready_ms'])
+    syncs = [timings['syncs'] for timings in readies]
+
+    print(f'import main: {import_ms:.0f}ms (best of {options.runs})')
+    for cumulative, name in imports[0][1][:8]:
+        print(f'  {name:<20} {cumulative:7.1f}ms')
+    print(f'on_ready: {ready["ready_ms"]:.1f}ms, again after a reconnect: {ready["reconnect_ms"]:.2f}ms')
+    print(f'command syncs per start: {", ".join(map(str, syncs))}')
+    print(f'process start to ready: {ready["process_ms"]:.0f}ms')
+
+    failed = False
+    if options.max_import_ms is not None and import_ms > options.max_import_ms:
+        print(f'REGRESSION: import took {import_ms:.0f}ms, limit is {options.max_import_ms:.0f}ms')
+        failed = True
+    if options.max_ready_ms is not None and ready['ready_ms'] > options.max_ready_ms:
+        print(f'REGRESSION: on_ready took {ready["ready_ms"]:.1f}ms, limit is {options.max_ready_ms:.0f}ms')
+        failed = True
+    if sum(syncs[1:]):
+        print('REGRESSION: commands were synced again although they did not change')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from work_questions import QuestionPool, parse_answer
+
+# /WORK QUESTION BENCHMARK
+#
+# Per-call latency of what /work does around the user's answer: building the
+# question and checking the answer. The old command solved 7x - 30 = 70 with
+# sympy on every call and ran sympy.sympify() on whatever the user typed; the
+# new one takes a question from the pool and parses the answer with a regex.
+# Needs sympy for the "before" numbers. Run with: python benchmarks/bench_work.py
+
+CALLS = 200
+ANSWERS = {
+    'correct': '100/7',
+    'wrong': '12',
+    'text': 'no idea',
+    'long input': '+'.join(['1'] * 800),
+}
+
+
+def old_work(sp, answer):
+    x = sp.symbols('x')
+    equation = sp.Eq(7 * x - 30, 70)
+    solution = sp.solve(equation, x)[0]
+    try:
+        return sp.sympify(answer) == solution
+    except Exception:
+        return False
+
+
+def new_work(pool, answer):
+    question = pool.take()
+    return parse_answer(answer) == question.answer
+
+
+def per_call_us(fn, *args, calls=CALLS):
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn(*args)
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+async def main():
+    pool = QuestionPool()
+
+    # Every pooled question must have the integer answer it claims
+    for _ in range(2000):
+        question = pool.take()
+        assert isinstance(question.answer, int), question
+    await asyncio.sleep(0)
+
+    try:
+        import sympy as sp
+    except ImportError:
+        sp = None
+        print('sympy not installed, only showing the new numbers')
+
+    print(f'{"answer":<12} {"before":>12} {"after":>10}')
+    for name, answer in ANSWERS.items():
+        after = per_call_us(new_work, pool, answer)
+        if sp is not None:
+            # Long inputs are slow enough with sympify that a few calls are plenty
+            before = per_call_us(old_work, sp, answer, calls=CALLS if name != 'long input' else 5)
+            print(f'{name:<12} {before:9.0f} us {after:7.2f} us')
+        else:
+            print(f'{name:<12} {"-":>12} {after:7.2f} us')
+        await asyncio.sleep(0)  # let the pool refill
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
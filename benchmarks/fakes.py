@@ -0,0 +1,175 @@
+import asyncio
+import re
+
+from database import LatencyStats
+
+# LOCAL DATABASE STAND-IN
+#
+# Implements DatabasePool's interface (run/fetchone/fetchall/execute) on top of
+# in-memory tables, so benchmarks can drive the real economy code without a
+# MySQL server. Only the statements Nexus actually issues are understood.
+
+
+def _normalize(query):
+    return ' '.join(query.split())
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+        self.rowcount = 0
+
+    def execute(self, query, params=()):
+        self.db.statements += 1
+        query = _normalize(query)
+        for pattern, handler in self.db.handlers:
+            match = pattern.match(query)
+            if match:
+                self.rows, self.rowcount = handler(match, params)
+                return
+        raise NotImplementedError(f'FakeDatabase does not understand: {query}')
+
+    def executemany(self, query, seq_params):
+        rowcount = 0
+        for params in seq_params:
+            self.execute(query, params)
+            rowcount += self.rowcount
+        self.rowcount = rowcount
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def close(self):
+        pass
+
+
+class FakeDatabase:
+    def __init__(self, latency=0.0):
+        # latency: seconds every transaction takes, like a round trip to MySQL
+        self.latency = latency
+        self.statements = 0
+        self.transactions = 0
+        self.query_stats = LatencyStats()
+        self.user_points = {}  # user_id -> {points, streak, last_collected, last_worked}
+        self.checkpoint = None
+        self.guild_words = {}  # guild_id -> set of words
+        self.guild_versions = {}
+        self.guild_welcome = {}  # guild_id -> (channel_id, message)
+        self.handlers = [(re.compile(pattern), handler) for pattern, handler in [
+            (r'SELECT points, streak, last_collected, last_worked FROM user_points WHERE user_id', self._select_account),
+            (r'SELECT points FROM user_points WHERE user_id', self._select_points),
+            (r'SELECT user_id, points FROM user_points ORDER BY points DESC LIMIT', self._select_top),
+            (r'SELECT COUNT\(\*\) FROM user_points WHERE points >', self._count_above),
+            (r'INSERT INTO user_points \(user_id, points, streak, last_collected, last_worked\) VALUES .* ON DUPLICATE KEY UPDATE (.*)', self._upsert_points),
+            (r'INSERT IGNORE INTO ledger_checkpoint', self._init_checkpoint),
+            (r'SELECT seq FROM ledger_checkpoint', self._select_checkpoint),
+            (r'UPDATE ledger_checkpoint SET seq', self._update_checkpoint),
+            (r'SELECT version FROM guild_word_list_versions', self._select_version),
+            (r'SELECT word FROM guild_banned_words', self._select_words),
+            (r'SELECT channel_id, message FROM guild_welcome', self._select_welcome),
+        ]]
+
+    # STATEMENTS
+
+    def _select_account(self, match, params):
+        row = self.user_points.get(params[0])
+        if row is None:
+            return [], 0
+        return [(row['points'], row['streak'], row['last_collected'], row['last_worked'])], 1
+
+    def _select_points(self, match, params):
+        row = self.user_points.get(params[0])
+        return ([(row['points'],)], 1) if row else ([], 0)
+
+    def _select_top(self, match, params):
+        ordered = sorted(self.user_points.items(), key=lambda item: item[1]['points'], reverse=True)
+        return [(user_id, row['points']) for user_id, row in ordered[:params[0]]], 0
+
+    def _count_above(self, match, params):
+        return [(sum(1 for row in self.user_points.values() if row['points'] > params[0]),)], 1
+
+    def _upsert_points(self, match, params):
+        user_id, points, streak, last_collected, last_worked = params
+        row = self.user_points.get(user_id)
+        if row is None:
+            self.user_points[user_id] = {'points': points, 'streak': streak, 'last_collected': last_collected, 'last_worked': last_worked}
+            return [], 1
+        row['points'] += points
+        values = {'streak': streak, 'last_collected': last_collected, 'last_worked': last_worked}
+        for field in values:
+            if f'{field} = VALUES({field})' in match.group(1):
+                row[field] = values[field]
+        return [], 2
+
+    def _init_checkpoint(self, match, params):
+        if self.checkpoint is None:
+            self.checkpoint = 0
+            return [], 1
+        return [], 0
+
+    def _select_checkpoint(self, match, params):
+        return ([(self.checkpoint,)], 1) if self.checkpoint is not None else ([], 0)
+
+    def _update_checkpoint(self, match, params):
+        self.checkpoint = params[0]
+        return [], 1
+
+    def _select_version(self, match, params):
+        version = self.guild_versions.get(params[0])
+        return ([(version,)], 1) if version is not None else ([], 0)
+
+    def _select_words(self, match, params):
+        return [(word,) for word in self.guild_words.get(params[0], ())], 0
+
+    def _select_welcome(self, match, params):
+        row = self.guild_welcome.get(params[0])
+        return ([row], 1) if row else ([], 0)
+
+    # DatabasePool INTERFACE
+
+    async def warm(self):
+        pass
+
+    def stats(self):
+        return {
+            'size': 1,
+            'idle': 1,
+            'waiting': 0,
+            'timeouts': 0,
+            'wait': LatencyStats().snapshot(),
+            'query': self.query_stats.snapshot(),
+        }
+
+    async def run(self, fn, *args):
+        started = asyncio.get_running_loop().time()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.transactions += 1
+        self.query_stats.add(asyncio.get_running_loop().time() - started)
+        # Transactions don't overlap here, which matches what MySQL's row locks give us
+        return fn(FakeCursor(self), *args)
+
+    async def fetchone(self, query, params=()):
+        def fetch(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchone()
+        return await self.run(fetch)
+
+    async def fetchall(self, query, params=()):
+        def fetch(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        return await self.run(fetch)
+
+    async def execute(self, query, params=()):
+        def execute(cursor):
+            cursor.execute(query, params)
+            return cursor.rowcount
+        return await self.run(execute)
+
+    def total_points(self):
+        return sum(row['points'] for row in self.user_points.values())
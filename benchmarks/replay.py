@@ -0,0 +1,316 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from discord import app_commands
+
+from stubs import FakeChannel, FakeGuild, FakeInteraction, FakeMember, FakeMessage, FakeUser, stub_main
+
+# GATEWAY EVENT REPLAY
+#
+# Replays a stream of gateway events (messages, member joins, slash commands)
+# into the bot's handlers at a set rate, with Discord's REST API and MySQL
+# replaced by local fakes that answer after a configurable latency. Every
+# event runs in its own task, like discord.py dispatches them. The rate is
+# stepped up stage by stage, and each stage reports throughput, p50/p99
+# latency from when the event was due until its handler finished, and how
+# late the event loop ran, so the point where the bot stops keeping up shows
+# in one run:
+#   python benchmarks/replay.py --scenario raid --rates 100,200,400,800
+# Events are synthesized from a scenario, or read from a JSON lines file
+# written with --save (one event per line, with its time `t` in seconds).
+
+SCENARIOS = {
+    # Share of messages, member joins and slash commands, how many messages contain a banned word,
+    # how many guilds the traffic is spread over and which commands are used how often
+    'chat': {
+        'events': {'message': 0.9, 'member_join': 0.02, 'interaction': 0.08},
+        'banned': 0.02,
+        'guilds': 50,
+        'users': 5000,
+        'commands': {'balance': 3, 'daily': 2, 'gamble': 3, 'transfer': 1, 'rank': 1, 'leaderboard': 1, 'help': 1},
+    },
+    'raid': {
+        'events': {'message': 0.6, 'member_join': 0.35, 'interaction': 0.05},
+        'banned': 0.3,
+        'guilds': 2,
+        'users': 20000,
+        'commands': {'balance': 1, 'rank': 1, 'help': 1},
+    },
+    'event': {
+        'events': {'message': 0.4, 'member_join': 0.05, 'interaction': 0.55},
+        'banned': 0.01,
+        'guilds': 10,
+        'users': 3000,
+        'commands': {'daily': 4, 'gamble': 6, 'transfer': 2, 'balance': 3, 'rank': 2, 'leaderboard': 3},
+    },
+}
+
+WORDS = 'the a you we they is was game stream tonight patch raid boss loot gg lol anyone join server voice map'.split()
+# Arguments that are users in the command, given as user ids in the event
+USER_ARGUMENTS = {'recipient'}
+
+
+def synthesize(scenario, count, rng, banned_words):
+    # Poisson arrivals at one event per second, replay() scales them to the stage's rate
+    settings = SCENARIOS[scenario]
+    kinds, kind_weights = zip(*settings['events'].items())
+    commands, command_weights = zip(*settings['commands'].items())
+    guilds = [10 ** 15 + i for i in range(settings['guilds'])]
+    events = []
+    t = 0.0
+    for kind in rng.choices(kinds, kind_weights, k=count):
+        t += rng.expovariate(1.0)
+        guild = rng.choice(guilds)
+        event = {'t': round(t, 6), 'type': kind, 'guild': guild, 'channel': guild + 1, 'user': 10 ** 16 + rng.randrange(settings['users'])}
+        if kind == 'message':
+            words = rng.choices(WORDS, k=rng.randint(2, 30))
+            if rng.random() < settings['banned']:
+                words.insert(rng.randrange(len(words)), rng.choice(banned_words))
+            event['content'] = ' '.join(words)
+        elif kind == 'interaction':
+            event['command'] = rng.choices(commands, command_weights)[0]
+            event['args'] = {
+                'gamble': {'bet_amount': rng.randint(1, 50)},
+                'transfer': {'recipient': 10 ** 16 + rng.randrange(settings['users']), 'amount': rng.randint(1, 20)},
+            }.get(event['command'], {})
+        events.append(event)
+    return events
+
+
+def save_events(path, events):
+    with open(path, 'w', encoding='utf-8') as f:
+        for event in events:
+            f.write(json.dumps(event) + '\n')
+
+
+def load_events(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class World:
+    # Stubbed guilds, channels and users, created the first time an event mentions them
+    def __init__(self, main, rest):
+        self.main = main
+        self.rest = rest
+        self.guilds = {}
+        self.channels = {}
+        self.users = {}
+        main.bot.get_channel = self.channels.get
+
+    def guild(self, guild_id):
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            guild = self.guilds[guild_id] = FakeGuild(self.rest, guild_id)
+            # Every guild has a welcome message, so joins cost what they would in production
+            self.main.db.guild_welcome[guild_id] = (guild_id + 1, 'Welcome %user_mention% to %guild_name%!')
+        return guild
+
+    def channel(self, guild_id, channel_id):
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = FakeChannel(self.rest, self.guild(guild_id), channel_id)
+        return channel
+
+    def user(self, user_id):
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = FakeUser(self.rest, user_id)
+        return user
+
+
+async def run_interaction(main, interaction, command, args):
+    # What CommandTree does for a slash command: the tree's and the command's checks, the callback, then the error or completion handler
+    try:
+        await main.tree.interaction_check(interaction)
+        for check in command.checks:
+            if not await check(interaction):
+                raise app_commands.CheckFailure()
+        await command.callback(interaction, **args)
+    except app_commands.AppCommandError as e:
+        await main.on_app_command_error(interaction, e)
+    except Exception as e:
+        await main.on_app_command_error(interaction, app_commands.CommandInvokeError(command, e))
+    else:
+        await main.on_app_command_completion(interaction, command)
+
+
+def handler(main, world, event):
+    # Builds the stubbed gateway objects up front, returns the coroutine that handles the event
+    channel = world.channel(event['guild'], event['channel'])
+    if event['type'] == 'message':
+        message = FakeMessage(world.rest, event['content'], world.user(event['user']), channel, main.bot._connection)
+        return main.on_message(message)
+    if event['type'] == 'member_join':
+        return main.on_member_join(FakeMember(world.rest, channel.guild, event['user']))
+    command = main.tree.get_command(event['command'])
+    args = {name: world.user(value) if name in USER_ARGUMENTS else value for name, value in event['args'].items()}
+    interaction = FakeInteraction(world.rest, world.user(event['user']), channel.guild, channel, command)
+    return run_interaction(main, interaction, command, args)
+
+
+async def watch_loop_lag(lags, interval=0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - expected))
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+async def replay(main, world, events, rate, duration, drain_timeout):
+    loop = asyncio.get_running_loop()
+    # Scale the recorded times to the stage's rate
+    scale = (events[-1]['t'] / len(events)) * rate if len(events) > 1 and events[-1]['t'] else 1.0
+    latencies = {}  # event type -> seconds from when it was due until its handler finished
+    errors = []
+    tasks = set()
+    lags = []
+    watcher = asyncio.ensure_future(watch_loop_lag(lags))
+
+    def finished(task, kind, due):
+        tasks.discard(task)
+        latencies.setdefault(kind, []).append(loop.time() - due)
+        if not task.cancelled() and task.exception() is not None:
+            errors.append(task.exception())
+
+    start = loop.time()
+    first_t = events[0]['t']
+    index = 0
+    while index < len(events):
+        now = loop.time()
+        if now - start > duration:
+            break
+        # Everything that is due goes out now, even if the loop fell behind
+        while index < len(events):
+            due = start + (events[index]['t'] - first_t) / scale
+            if due > now:
+                break
+            event = events[index]
+            task = loop.create_task(handler(main, world, event))
+            # Slash commands are reported per command
+            kind = f'/{event["command"]}' if event['type'] == 'interaction' else event['type']
+            task.add_done_callback(lambda task, kind=kind, due=due: finished(task, kind, due))
+            tasks.add(task)
+            index += 1
+        if index < len(events):
+            await asyncio.sleep(max(0.0, start + (events[index]['t'] - first_t) / scale - loop.time()))
+    sent_for = loop.time() - start
+
+    if tasks:
+        await asyncio.wait(list(tasks), timeout=drain_timeout)
+    elapsed = loop.time() - start
+    watcher.cancel()
+    for task in tasks:
+        task.cancel()
+
+    every = [latency for samples in latencies.values() for latency in samples]
+    return {
+        'rate': rate,
+        'sent': index,
+        'completed': len(every),
+        'unfinished': len(tasks),
+        'errors': len(errors),
+        'offered_per_s': index / sent_for if sent_for else 0.0,
+        'throughput_per_s': len(every) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(every, 0.5) * 1000,
+        'p99_ms': percentile(every, 0.99) * 1000,
+        'by_type': {kind: {'count': len(samples), 'p50_ms': percentile(samples, 0.5) * 1000, 'p99_ms': percentile(samples, 0.99) * 1000}
+                    for kind, samples in sorted(latencies.items())},
+        'loop_lag_p99_ms': percentile(lags, 0.99) * 1000,
+        'loop_lag_max_ms': max(lags, default=0.0) * 1000,
+        'first_error': repr(errors[0]) if errors else None,
+    }
+
+
+def keeps_up(stage, max_p99_ms):
+    return not stage['unfinished'] and stage['throughput_per_s'] >= stage['offered_per_s'] * 0.9 and stage['p99_ms'] <= max_p99_ms
+
+
+async def run(options):
+    os.environ.setdefault('LEDGER_FLUSH_INTERVAL', '1')
+    main, db, rest = stub_main(db_latency=options.db_latency_ms / 1000, rest_latency=options.rest_latency_ms / 1000)
+    world = World(main, rest)
+    rates = [int(rate) for rate in options.rates.split(',')]
+
+    if options.events:
+        events = load_events(options.events)
+    else:
+        events = synthesize(options.scenario, int(max(rates) * options.duration), random.Random(options.seed), main.banned_words)
+    if options.save:
+        save_events(options.save, events)
+
+    await main.entitlements.has_premium(0)
+    print(f'{len(events)} events, REST {options.rest_latency_ms:g}ms, MySQL {options.db_latency_ms:g}ms')
+    print(f'{"rate/s":>7} {"offered":>8} {"done/s":>8} {"p50":>9} {"p99":>9} {"loop lag p99":>13} {"max":>8} {"errors":>7}')
+    stages = []
+    for rate in rates:
+        started = time.perf_counter()
+        stage = await replay(main, world, events, rate, options.duration, options.drain_timeout)
+        stage['wall_s'] = time.perf_counter() - started
+        stages.append(stage)
+        print(f'{rate:>7} {stage["offered_per_s"]:8.0f} {stage["throughput_per_s"]:8.0f} {stage["p50_ms"]:7.1f}ms {stage["p99_ms"]:7.1f}ms '
+              f'{stage["loop_lag_p99_ms"]:11.1f}ms {stage["loop_lag_max_ms"]:6.0f}ms {stage["errors"]:>7}')
+        for kind, latency in stage['by_type'].items():
+            print(f'{"":>7} {kind:<17} {latency["count"]:>8} {latency["p50_ms"]:7.1f}ms {latency["p99_ms"]:7.1f}ms')
+        if stage['first_error']:
+            print(f'{"":>7} first error: {stage["first_error"]}')
+        await main.ledger.flush()
+
+    degraded = next((stage['rate'] for stage in stages if not keeps_up(stage, options.max_p99_ms)), None)
+    if degraded is None:
+        print(f'Kept up with every rate (p99 under {options.max_p99_ms:g}ms)')
+    else:
+        print(f'Falls behind at {degraded} events/s (throughput below 90% of the offered rate or p99 over {options.max_p99_ms:g}ms)')
+    return {
+        'scenario': None if options.events else options.scenario,
+        'events': options.events,
+        'rest_latency_ms': options.rest_latency_ms,
+        'db_latency_ms': options.db_latency_ms,
+        'degrades_at': degraded,
+        'stages': stages,
+        'db_statements': db.statements,
+        'rest_calls': rest.calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='chat')
+    parser.add_argument('--events', help='replay events from this JSON lines file instead of a scenario')
+    parser.add_argument('--save', help='write the events to this JSON lines file')
+    parser.add_argument('--rates', default='50,100,200,400,800,1600', help='events per second, one stage each')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per stage')
+    parser.add_argument('--rest-latency-ms', type=float, default=40.0)
+    parser.add_argument('--db-latency-ms', type=float, default=2.0)
+    parser.add_argument('--max-p99-ms', type=float, default=250.0, help='slowest p99 that still counts as keeping up')
+    parser.add_argument('--drain-timeout', type=float, default=30.0, help='seconds to wait for handlers after a stage')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the report as JSON')
+    options = parser.parse_args()
+
+    report = asyncio.run(run(options))
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f'Report written to {options.output}')
+    # Handler tasks that never finished would keep the process alive
+    sys.stdout.flush()
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
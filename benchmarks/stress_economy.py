@@ -0,0 +1,89 @@
+import asyncio
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeDatabase
+from ledger import Ledger
+
+# ECONOMY CONCURRENCY CHECK
+#
+# Fires hundreds of parallel gambles and transfers at one hot account through
+# the ledger, against the local database stand-in, then checks that no balance
+# went negative and that every point is accounted for, both in memory and in
+# the database after the final flush. Exits with status 1 on any violation.
+# Run with: python benchmarks/stress_economy.py
+
+HOT_USER = 1
+FEE_USER = 1011702976555004007
+OTHER_USERS = list(range(2, 22))
+START_POINTS = 1000
+OPERATIONS = 2000
+
+
+async def gamble(ledger, rng, stats):
+    account = await ledger.account(HOT_USER)
+    bet = rng.randint(1, 200)
+    winnings = int(bet * round(rng.uniform(0, 2), 1))
+    if ledger.spend(account, bet, [(account, winnings)]):
+        stats['created'] += winnings - bet
+        stats['gambles'] += 1
+    else:
+        stats['rejected'] += 1
+
+
+async def transfer(ledger, rng, stats):
+    # Half the transfers drain the hot account, the other half feed it
+    if rng.random() < 0.5:
+        sender, recipient = HOT_USER, rng.choice(OTHER_USERS)
+    else:
+        sender, recipient = rng.choice(OTHER_USERS), HOT_USER
+    amount = rng.randint(1, 150)
+    fee = int(amount * rng.randint(5, 15) / 100)
+
+    sender_account = await ledger.account(sender)
+    recipient_account = await ledger.account(recipient)
+    fee_account = await ledger.account(FEE_USER)
+    if ledger.spend(sender_account, amount + fee, [(recipient_account, amount), (fee_account, fee)]):
+        stats['transfers'] += 1
+    else:
+        stats['rejected'] += 1
+
+
+async def main():
+    rng = random.Random(42)
+    db = FakeDatabase(latency=0.001)
+    journal = os.path.join(tempfile.mkdtemp(), 'ledger.journal')
+    ledger = Ledger(db, journal, flush_interval=0.02)
+
+    for user_id in [HOT_USER] + OTHER_USERS:
+        ledger.apply(await ledger.account(user_id), START_POINTS)
+    expected = START_POINTS * (1 + len(OTHER_USERS))
+
+    stats = {'created': 0, 'gambles': 0, 'transfers': 0, 'rejected': 0}
+    operations = [gamble(ledger, rng, stats) if rng.random() < 0.5 else transfer(ledger, rng, stats) for _ in range(OPERATIONS)]
+    await asyncio.gather(*operations)
+    await ledger.close()
+    expected += stats['created']
+
+    user_ids = [HOT_USER, FEE_USER] + OTHER_USERS
+    accounts = ledger._accounts
+    memory_total = sum(accounts[user_id].points for user_id in user_ids if user_id in accounts)
+    negative = [user_id for user_id, row in db.user_points.items() if row['points'] < 0]
+
+    print(f"{stats['gambles']} gambles, {stats['transfers']} transfers, {stats['rejected']} rejected for insufficient points")
+    print(f'{db.transactions} database transactions, {db.statements} statements, {ledger.flushes} flushes')
+    print(f'expected total {expected}, in memory {memory_total}, in database {db.total_points()}')
+
+    ok = expected == memory_total == db.total_points() and not negative and db.checkpoint == ledger._seq
+    if negative:
+        print(f'negative balances: {negative}')
+    print('OK' if ok else 'FAILED')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
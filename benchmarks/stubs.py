@@ -0,0 +1,187 @@
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakes import FakeDatabase
+
+# STUBBED DISCORD OBJECTS
+#
+# Just enough of discord.py's User, Guild, Channel, Message and Interaction for
+# Nexus' handlers to run without a gateway connection. Nothing is sent
+# anywhere, every REST call is counted and returns immediately (or after
+# `latency` seconds, like a round trip to Discord).
+
+BOT_USER_ID = 1
+PREMIUM_USER_ID = 2
+
+_ids = itertools.count(10 ** 17)
+
+
+def next_id():
+    return next(_ids)
+
+
+class Rest:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    async def call(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeUser:
+    def __init__(self, rest, user_id=None, name=None, bot=False):
+        self.rest = rest
+        self.id = user_id or next_id()
+        self.name = name or f'user{self.id % 100000}'
+        self.display_name = self.name
+        self.bot = bot
+        self.mention = f'<@{self.id}>'
+
+    def __str__(self):
+        return self.name
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    async def send(self, *args, **kwargs):
+        await self.rest.call()
+
+
+class FakeMember(FakeUser):
+    def __init__(self, rest, guild, user_id=None, name=None):
+        super().__init__(rest, user_id, name)
+        self.guild = guild
+
+
+class FakeGuild:
+    def __init__(self, rest, guild_id=None, name=None):
+        self.rest = rest
+        self.id = guild_id or next_id()
+        self.name = name or f'guild{self.id % 100000}'
+        self.member_count = 100
+        self.voice_client = None
+        self.channels = {}
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+
+class FakeChannel:
+    def __init__(self, rest, guild, channel_id=None, name='general'):
+        self.rest = rest
+        self.guild = guild
+        self.id = channel_id or next_id()
+        self.name = name
+        self.mention = f'<#{self.id}>'
+        guild.channels[self.id] = self
+
+    async def send(self, content=None, **kwargs):
+        await self.rest.call()
+        return FakeMessage(self.rest, content or '', None, self)
+
+
+class FakeMessage:
+    def __init__(self, rest, content, author, channel, state=None):
+        self.rest = rest
+        self.id = next_id()
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self._state = state
+
+    async def delete(self, **kwargs):
+        await self.rest.call()
+
+
+class FakeResponse:
+    def __init__(self, rest):
+        self.rest = rest
+        self.sent = []
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def send_message(self, content=None, **kwargs):
+        await self.rest.call()
+        self._done = True
+        self.sent.append(kwargs.get('embed') or content)
+
+    async def defer(self, **kwargs):
+        await self.rest.call()
+        self._done = True
+
+
+class FakeFollowup:
+    def __init__(self, rest):
+        self.rest = rest
+
+    async def send(self, content=None, **kwargs):
+        await self.rest.call()
+        return SimpleNamespace(id=next_id(), edit=self.edit)
+
+    async def edit(self, **kwargs):
+        await self.rest.call()
+
+
+class FakeInteraction:
+    def __init__(self, rest, user, guild, channel, command=None):
+        self.user = user
+        self.guild = guild
+        self.channel = channel
+        self.command = command
+        self.created_at = datetime.now(timezone.utc)
+        self.extras = {}
+        self.response = FakeResponse(rest)
+        self.followup = FakeFollowup(rest)
+
+
+def import_main():
+    # main.py reads its settings at import time, keep its files out of the repository's data/
+    data = tempfile.mkdtemp()
+    os.environ.setdefault('LEDGER_JOURNAL', os.path.join(data, 'ledger.journal'))
+    os.environ.setdefault('AI_CACHE_PATH', '')
+    os.environ.setdefault('COMMAND_MANIFEST', os.path.join(data, 'command_manifest.json'))
+    os.environ.setdefault('DISCORD_BOT_TOKEN', 'benchmark')
+    os.environ.setdefault('METRICS_PORT', '0')
+    import main
+    return main
+
+
+def stub_main(db_latency=0.0, rest_latency=0.0):
+    # Imports main.py and swaps everything that would leave the process for local fakes.
+    # Returns (main, db, rest).
+    main = import_main()
+    db = FakeDatabase(latency=db_latency)
+    rest = Rest(latency=rest_latency)
+
+    main.db = db
+    main.ledger.db = db
+    main.bot._connection.user = SimpleNamespace(name='Nexus', id=BOT_USER_ID, bot=True)
+
+    async def fetch_entitlements():
+        await rest.call()
+        return [SimpleNamespace(id=next_id(), sku_id=main.PREMIUM_SKU_ID, user_id=PREMIUM_USER_ID, deleted=False, ends_at=None)]
+
+    async def fetch_user(user_id):
+        await rest.call()
+        return FakeUser(rest, user_id)
+
+    main.entitlements._fetch = fetch_entitlements
+    main.user_names._fetch_user = fetch_user
+    return main, db, rest
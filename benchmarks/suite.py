@@ -0,0 +1,243 @@
+import argparse
+import asyncio
+import gc
+import inspect
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from array import array
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stubs import ROOT, PREMIUM_USER_ID, FakeChannel, FakeGuild, FakeInteraction, FakeMessage, FakeUser, stub_main
+
+# MICRO-BENCHMARK SUITE
+#
+# Runs Nexus' hot paths in-process with stubbed Discord objects and the local
+# database stand-in: the on_message filter, the /timeout duration parser, the
+# /help embed, the economy commands and the premium check. For every case it
+# records the latency per call (mean, p50, p99) and the memory a call
+# allocates (peak while it runs, and what is still held afterwards), and
+# writes everything to a JSON file. Given the file of an earlier run it flags
+# cases that got slower or allocate more and exits with status 1:
+#   python benchmarks/suite.py --output data/bench-1.4.json
+#   python benchmarks/suite.py --baseline data/bench-1.4.json
+
+DEFAULT_OUTPUT = os.path.join(ROOT, 'data', 'benchmark_results.json')
+# Differences below these are noise, not regressions
+MIN_LATENCY_US = 2.0
+MIN_BYTES = 512
+
+
+class Case:
+    def __init__(self, name, run, prepare=None):
+        self.name = name
+        self.run = run  # run(arg), sync or async
+        self.prepare = prepare or (lambda i: None)  # prepare(i) -> arg, not measured
+
+    async def call(self, arg):
+        result = self.run(arg)
+        if inspect.isawaitable(result):
+            await result
+
+
+async def build_cases(main, rest):
+    guild = FakeGuild(rest)
+    channel = FakeChannel(rest, guild)
+    sticky_channel = FakeChannel(rest, guild, name='sticky')
+    author = FakeUser(rest)
+    rich = FakeUser(rest)
+    recipient = FakeUser(rest)
+    state = main.bot._connection
+    banned_word = main.banned_words[0]
+
+    # Everything a case reads is loaded once up front, so the cases measure the steady state
+    await main.load_guild_matcher(guild.id)
+    await main.sticky_messages.stick(sticky_channel, 'Read the rules!', author.id)
+    await main.entitlements.has_premium(PREMIUM_USER_ID)
+    main.ledger.apply(await main.ledger.account(rich.id), 10 ** 12)
+    for rank in range(20):
+        main.ledger.apply(await main.ledger.account(FakeUser(rest).id), 10 ** 6 + rank)
+    await main.load_points_ranking()
+
+    def message(content, in_channel=channel):
+        return lambda i: FakeMessage(rest, content, author, in_channel, state)
+
+    def interaction(user=None):
+        return lambda i: FakeInteraction(rest, user or FakeUser(rest), guild, channel)
+
+    return [
+        Case('on_message clean', main.on_message, message('hey, did anyone see the patch notes for tonight?')),
+        Case('on_message banned word', main.on_message, message(f'you are such a {banned_word.upper()} honestly')),
+        Case('on_message sticky channel', main.on_message, message('anyone around?', sticky_channel)),
+        Case('on_message long', main.on_message, message('lorem ipsum dolor sit amet ' * 70)),
+        Case('timeout parse_duration', main.parse_duration, lambda i: ('30s', '15min', '2h', '7d', '1w')[i % 5]),
+        Case('help embed', lambda arg: main.build_help_embed()),
+        Case('daily new user', main.daily.callback, interaction()),
+        Case('balance', main.balance.callback, interaction(rich)),
+        Case('gamble', lambda interaction: main.gamble.callback(interaction, 10), interaction(rich)),
+        Case('transfer', lambda interaction: main.transfer.callback(interaction, recipient, 5), interaction(rich)),
+        Case('rank outside top', main.rank.callback, interaction(recipient)),
+        Case('leaderboard', main.leaderboard.callback, interaction()),
+        Case('entitlement check', lambda user_id: main.entitlements.has_premium(user_id), lambda i: PREMIUM_USER_ID if i % 2 else author.id),
+    ]
+
+
+async def settle(main):
+    # Let tasks a handler started (sticky reposts, matcher loads) run, and write the balance changes
+    # the ledger would flush every second, so every run flushes at the same points
+    for _ in range(3):
+        await asyncio.sleep(0)
+    await main.ledger.flush()
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+async def measure_latency(main, case, iterations):
+    samples = []
+    for i in range(iterations):
+        arg = case.prepare(i)
+        started = time.perf_counter_ns()
+        await case.call(arg)
+        samples.append((time.perf_counter_ns() - started) / 1000)
+        if i % 50 == 0:
+            await settle(main)
+    samples.sort()
+    return {
+        'mean_us': sum(samples) / len(samples),
+        'p50_us': percentile(samples, 0.5),
+        'p99_us': percentile(samples, 0.99),
+    }
+
+
+async def measure_memory(main, case, iterations):
+    # Peak: the most memory a single call had allocated at once. Retained: what the calls still hold afterwards.
+    args = [case.prepare(i) for i in range(iterations)]
+    await settle(main)
+    gc.collect()
+    tracemalloc.start()
+    peaks = array('q', [0]) * iterations  # a list of ints would count towards the retained bytes
+    start, _ = tracemalloc.get_traced_memory()
+    for i in range(iterations):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        await case.call(args[i])
+        _, peak = tracemalloc.get_traced_memory()
+        peaks[i] = peak - before
+    del args
+    gc.collect()
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    peaks = sorted(peaks)
+    return {
+        'peak_bytes': percentile(peaks, 0.5),
+        'retained_bytes': max(0, end - start) / iterations,
+    }
+
+
+def compare(results, baseline, latency_threshold, memory_threshold):
+    regressions = []
+    for name, case in results['cases'].items():
+        before = baseline['cases'].get(name)
+        if before is None:
+            continue
+        # p99 moves too much between runs on a shared machine to fail on, it is only recorded
+        for field, threshold, minimum in [
+            ('p50_us', latency_threshold, MIN_LATENCY_US),
+            ('peak_bytes', memory_threshold, MIN_BYTES),
+            ('retained_bytes', memory_threshold, MIN_BYTES),
+        ]:
+            old, new = before[field], case[field]
+            if new - old > minimum and new > old * (1 + threshold):
+                regressions.append((name, field, old, new))
+    return regressions
+
+
+async def run(options):
+    # Flushes happen in settle() instead of on a timer
+    os.environ['LEDGER_FLUSH_INTERVAL'] = '3600'
+    main, db, rest = stub_main()
+    cases = await build_cases(main, rest)
+    if options.only:
+        cases = [case for case in cases if any(word in case.name for word in options.only)]
+
+    results = {
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'label': options.label,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'iterations': options.iterations,
+        'rounds': options.rounds,
+        'cases': {},
+    }
+    for case in cases:
+        for i in range(options.warmup):
+            await case.call(case.prepare(i))
+    await settle(main)
+
+    # Other processes on the machine only ever make a round slower, so the fastest round of each case counts.
+    # Rounds go over all cases in turn, a slow stretch then doesn't hit a single case every time.
+    rounds = {case.name: [] for case in cases}
+    for _ in range(options.rounds):
+        for case in cases:
+            rounds[case.name].append(await measure_latency(main, case, options.iterations))
+            await settle(main)
+
+    print(f'{"case":<28} {"mean":>9} {"p50":>9} {"p99":>9} {"peak":>9} {"retained":>9}')
+    for case in cases:
+        timings = min(rounds[case.name], key=lambda timings: timings['p50_us'])
+        memory = await measure_memory(main, case, options.memory_iterations)
+        await settle(main)
+        results['cases'][case.name] = {**timings, **memory}
+        print(f'{case.name:<28} {timings["mean_us"]:7.1f}us {timings["p50_us"]:7.1f}us {timings["p99_us"]:7.1f}us '
+              f'{memory["peak_bytes"] / 1024:7.1f}KB {memory["retained_bytes"]:8.0f}B')
+    results['db_statements'] = db.statements
+    results['rest_calls'] = rest.calls
+    await main.ledger.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=500, help='calls per case and round')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--memory-iterations', type=int, default=500)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--label', help='stored in the results, e.g. the release being measured')
+    parser.add_argument('--baseline', help='results file of an earlier run to compare against')
+    parser.add_argument('--latency-threshold', type=float, default=0.25, help='allowed p50 slowdown, 0.25 = 25%%')
+    parser.add_argument('--memory-threshold', type=float, default=0.25, help='allowed growth of allocated bytes')
+    parser.add_argument('--only', nargs='*', help='only run cases whose name contains one of these')
+    options = parser.parse_args()
+
+    baseline = None
+    if options.baseline:
+        with open(options.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    results = asyncio.run(run(options))
+
+    os.makedirs(os.path.dirname(os.path.abspath(options.output)), exist_ok=True)
+    with open(options.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {options.output}')
+
+    if baseline is None:
+        return 0
+    regressions = compare(results, baseline, options.latency_threshold, options.memory_threshold)
+    for name, field, old, new in regressions:
+        print(f'REGRESSION: {name} {field} {old:.1f} -> {new:.1f} ({(new / old - 1) * 100 if old else float("inf"):+.0f}%)')
+    if not regressions:
+        print(f'No regressions against {options.baseline}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
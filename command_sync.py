@@ -0,0 +1,46 @@
+import hashlib
+import json
+import os
+
+# COMMAND TREE SYNC
+#
+# Uploading the global command set is rate limited, and the commands only
+# change when the bot is updated. The payload tree.sync() would send is hashed
+# and the hash of the last successful sync is stored in a local file, so a
+# restart with the same commands doesn't sync at all.
+
+
+def manifest_hash(tree, application_id):
+    commands = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda command: (command['type'], command['name']))
+    payload = json.dumps({'application_id': application_id, 'commands': commands}, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('hash')
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(path, digest, count):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'hash': digest, 'commands': count}, f)
+    os.replace(tmp_path, path)
+
+
+async def sync_if_changed(tree, application_id, path, logger=None):
+    # Returns True if the commands were uploaded
+    digest = manifest_hash(tree, application_id)
+    if digest == load_manifest(path):
+        if logger:
+            logger.info('Application commands unchanged, skipping sync')
+        return False
+    synced = await tree.sync()
+    save_manifest(path, digest, len(synced))
+    if logger:
+        logger.info(f'Synced {len(synced)} application commands')
+    return True
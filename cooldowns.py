@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+# COOLDOWNS
+#
+# When each user's cooldown ends, per command, kept in memory. A user that
+# isn't known yet is looked up once with the command's `load` function (e.g.
+# from their last_collected time in the database); after that, users on
+# cooldown are turned away without touching the database.
+
+
+class Cooldowns:
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.loads = 0
+        self._ends = {}  # (name, key) -> unix time the cooldown ends, 0 if there is none
+        self._loading = {}  # (name, key) -> task running load()
+
+    def __len__(self):
+        return len(self._ends)
+
+    async def remaining(self, name, key, load=None):
+        # Seconds until the cooldown ends, 0 if there is none
+        ends = self._ends.get((name, key))
+        if ends is not None:
+            self.hits += 1
+        elif load is not None:
+            ends = await self._load(name, key, load)
+        return max(0.0, ends - time.time()) if ends else 0.0
+
+    async def _load(self, name, key, load):
+        task = self._loading.get((name, key))
+        if task is None:
+            self.loads += 1
+            task = asyncio.ensure_future(load(key))
+            self._loading[(name, key)] = task
+            task.add_done_callback(lambda _: self._loading.pop((name, key), None))
+        ends = await asyncio.shield(task)
+        # start() may have run while this was loading, that one is newer
+        return self._set(name, key, ends or 0, keep_existing=True)
+
+    def start(self, name, key, seconds):
+        self._set(name, key, time.time() + seconds)
+
+    def reset(self, name, key):
+        self._ends.pop((name, key), None)
+
+    def _set(self, name, key, ends, keep_existing=False):
+        if keep_existing and (name, key) in self._ends:
+            return self._ends[(name, key)]
+        if len(self._ends) >= self.max_entries:
+            self.prune()
+        self._ends[(name, key)] = ends
+        return ends
+
+    def prune(self):
+        # Expired cooldowns are only worth a reload, drop them first, then the oldest entries
+        now = time.time()
+        for entry in [entry for entry, ends in self._ends.items() if ends <= now]:
+            del self._ends[entry]
+        while len(self._ends) >= self.max_entries:
+            del self._ends[next(iter(self._ends))]
@@ -0,0 +1,229 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import mysql.connector
+from mysql.connector import Error, errors
+
+# ASYNC DATABASE POOL
+#
+# mysql.connector is blocking, so every query runs on a small dedicated thread
+# pool and the event loop only awaits the result. Connections are kept open
+# and reused instead of logging in again for every command.
+
+
+class PoolTimeoutError(Error):
+    pass
+
+
+class LatencyStats:
+    def __init__(self, samples=1000, observe=None):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.observe = observe  # also called with every sample, e.g. a metrics histogram
+        self._recent = deque(maxlen=samples)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self._recent.append(seconds)
+        if self.observe is not None:
+            self.observe(seconds)
+
+    def snapshot(self):
+        recent = sorted(self._recent)
+
+        def pick(q):
+            return recent[min(len(recent) - 1, int(q * len(recent)))] * 1000 if recent else 0.0
+
+        return {
+            'count': self.count,
+            'avg_ms': (self.total / self.count) * 1000 if self.count else 0.0,
+            'p50_ms': pick(0.50),
+            'p95_ms': pick(0.95),
+            'max_ms': self.max * 1000,
+        }
+
+
+class DatabasePool:
+    def __init__(self, min_size=2, max_size=10, acquire_timeout=5.0, health_check_interval=30.0, **connect_kwargs):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self.connect_kwargs = connect_kwargs
+
+        self.wait_stats = LatencyStats()
+        self.query_stats = LatencyStats()
+        self.timeouts = 0
+
+        self._idle = deque()  # (connection, last_used)
+        self._size = 0
+        self._waiters = deque()
+        self._executor = ThreadPoolExecutor(max_workers=max_size, thread_name_prefix='nexus-db')
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _connect(self):
+        return mysql.connector.connect(**self.connect_kwargs)
+
+    def _check(self, conn):
+        # Reconnects in place if the server dropped the connection
+        conn.ping(reconnect=True, attempts=1, delay=0)
+
+    async def _open(self):
+        self._size += 1
+        try:
+            return await self._call(self._connect)
+        except BaseException:
+            self._size -= 1
+            self._wake()
+            raise
+
+    def _discard(self, conn):
+        self._size -= 1
+        try:
+            conn.close()
+        except Error:
+            pass
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def warm(self):
+        # Opens connections until min_size are available
+        while self._size < self.min_size:
+            self._idle.append((await self._open(), time.monotonic()))
+            self._wake()
+
+    async def _acquire(self):
+        started = time.monotonic()
+        deadline = started + self.acquire_timeout
+        while True:
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if time.monotonic() - last_used < self.health_check_interval:
+                    self.wait_stats.add(time.monotonic() - started)
+                    return conn
+                try:
+                    await self._call(self._check, conn)
+                except Error:
+                    self._discard(conn)
+                    continue
+                except BaseException:
+                    self._discard(conn)
+                    raise
+                self.wait_stats.add(time.monotonic() - started)
+                return conn
+
+            if self._size < self.max_size:
+                conn = await self._open()
+                self.wait_stats.add(time.monotonic() - started)
+                return conn
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.timeouts += 1
+                raise PoolTimeoutError(msg=f'Timed out after {self.acquire_timeout}s waiting for a database connection')
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                # A waiter that timed out or was cancelled isn't waiting anymore, stats() shouldn't count it
+                if not waiter.done() or waiter.cancelled():
+                    try:
+                        self._waiters.remove(waiter)
+                    except ValueError:
+                        pass
+
+    def _release(self, conn):
+        self._idle.append((conn, time.monotonic()))
+        self._wake()
+
+    async def run(self, fn, *args):
+        # Runs fn(cursor, *args) in a single transaction on a pooled connection
+        conn = await self._acquire()
+
+        def transaction():
+            cursor = conn.cursor()
+            try:
+                result = fn(cursor, *args)
+                conn.commit()
+                return result
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+        started = time.monotonic()
+        future = asyncio.get_running_loop().run_in_executor(self._executor, transaction)
+
+        def finish(done):
+            self.query_stats.add(time.monotonic() - started)
+            exc = None if done.cancelled() else done.exception()
+            # Broken connections are thrown away, anything else (e.g. a duplicate key) can be reused
+            if isinstance(exc, (errors.OperationalError, errors.InterfaceError)):
+                self._discard(conn)
+            else:
+                self._release(conn)
+
+        # The connection goes back to the pool only once the thread is done with it,
+        # even if the awaiting command gets cancelled halfway through
+        future.add_done_callback(finish)
+        return await asyncio.shield(future)
+
+    async def fetchone(self, query, params=()):
+        def fetch(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchone()
+        return await self.run(fetch)
+
+    async def fetchall(self, query, params=()):
+        def fetch(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        return await self.run(fetch)
+
+    async def execute(self, query, params=()):
+        def execute(cursor):
+            cursor.execute(query, params)
+            return cursor.rowcount
+        return await self.run(execute)
+
+    def stats(self):
+        return {
+            'size': self._size,
+            'idle': len(self._idle),
+            'waiting': len(self._waiters),
+            'timeouts': self.timeouts,
+            'wait': self.wait_stats.snapshot(),
+            'query': self.query_stats.snapshot(),
+        }
+
+    async def close(self):
+        while self._idle:
+            conn, _ = self._idle.pop()
+            self._size -= 1
+            await self._call(conn.close)
+        self._executor.shutdown(wait=False)
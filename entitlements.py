@@ -0,0 +1,113 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+# ENTITLEMENT INDEX
+#
+# Keeps the premium entitlements in memory, keyed by user id, so premium checks
+# are a dict lookup instead of downloading and scanning the whole entitlement
+# list. The index is kept current from the gateway entitlement events and is
+# fully refreshed in the background once the TTL runs out. After a failed
+# refresh the API isn't asked again for `retry_after` seconds.
+
+
+class EntitlementIndex:
+    def __init__(self, sku_id, fetch, ttl=600, retry_after=60, logger=None):
+        self.sku_id = int(sku_id)
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.logger = logger
+        self._fetch = fetch  # async () -> list of entitlements
+        self._users = {}  # user_id -> {entitlement_id: ends_at}
+        self._loaded_at = None
+        self._failed_at = None
+        self._refresh_task = None
+        self._missed_events = []
+
+    def __len__(self):
+        return len(self._users)
+
+    @property
+    def is_stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    @property
+    def backing_off(self):
+        return self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_after
+
+    def _build(self, entitlements):
+        users = {}
+        for entitlement in entitlements:
+            if self._counts(entitlement):
+                users.setdefault(entitlement.user_id, {})[entitlement.id] = entitlement.ends_at
+        return users
+
+    def _counts(self, entitlement):
+        return entitlement.sku_id == self.sku_id and entitlement.user_id is not None and not entitlement.deleted
+
+    def _apply(self, added, entitlement):
+        if added and self._counts(entitlement):
+            self._users.setdefault(entitlement.user_id, {})[entitlement.id] = entitlement.ends_at
+            return
+        owned = self._users.get(entitlement.user_id)
+        if owned is None:
+            return
+        owned.pop(entitlement.id, None)
+        if not owned:
+            del self._users[entitlement.user_id]
+
+    def add(self, entitlement):
+        # Used for both create and update events, an update can also end an entitlement
+        if self._refresh_task is not None:
+            self._missed_events.append((True, entitlement))
+        self._apply(True, entitlement)
+
+    def remove(self, entitlement):
+        if self._refresh_task is not None:
+            self._missed_events.append((False, entitlement))
+        self._apply(False, entitlement)
+
+    def is_active(self, user_id):
+        owned = self._users.get(user_id)
+        if not owned:
+            return False
+        now = datetime.now(timezone.utc)
+        return any(ends_at is None or ends_at > now for ends_at in owned.values())
+
+    async def _refresh(self):
+        self._missed_events = []
+        try:
+            users = self._build(await self._fetch())
+        except Exception as e:
+            self._failed_at = time.monotonic()
+            if self.logger:
+                self.logger.error(f"Failed to refresh entitlements: {e}")
+            if self._loaded_at is None:
+                raise
+            return
+        finally:
+            self._refresh_task = None
+
+        # Replay gateway events that arrived while the list was downloading
+        missed, self._missed_events = self._missed_events, []
+        self._users = users
+        self._loaded_at = time.monotonic()
+        self._failed_at = None
+        for added, entitlement in missed:
+            self._apply(added, entitlement)
+
+    def refresh(self):
+        # Only one refresh runs at a time, concurrent callers share it
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+        return self._refresh_task
+
+    async def has_premium(self, user_id):
+        if self._loaded_at is None:
+            if self.backing_off and self._refresh_task is None:
+                raise RuntimeError('Entitlements could not be loaded, trying again shortly')
+            # Nothing loaded yet, this is the only time a check waits for the API
+            await asyncio.shield(self.refresh())
+        elif self.is_stale and not self.backing_off:
+            self.refresh()  # Keep answering from the current index meanwhile
+        return self.is_active(user_id)
@@ -0,0 +1,67 @@
+import asyncio
+import random
+
+import aiohttp
+
+# STATUS HEARTBEAT
+#
+# Pushes to the Uptime Kuma push monitor from a background task. It uses one
+# keep-alive session for every push, so a slow status host only delays the
+# heartbeat and never the event loop. Failed pushes are retried with a jittered
+# exponential backoff.
+
+
+class StatusHeartbeat:
+    def __init__(self, url, interval=60, timeout=10, retry_delay=5, logger=None):
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.logger = logger
+        self.failures = 0
+        self.last_status = None
+        self._task = None
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.is_running():
+            self._task = asyncio.ensure_future(self._run())
+        return self._task
+
+    def stop(self):
+        if self.is_running():
+            self._task.cancel()
+
+    def next_delay(self):
+        if not self.failures:
+            return self.interval
+        backoff = min(self.interval, self.retry_delay * 2 ** (self.failures - 1))
+        return backoff * random.uniform(0.5, 1.5)
+
+    async def push(self, session):
+        async with session.get(self.url) as response:
+            await response.read()
+            return response.status
+
+    async def _run(self):
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        connector = aiohttp.TCPConnector(limit=1, keepalive_timeout=self.interval * 2)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            while True:
+                try:
+                    self.last_status = await self.push(session)
+                    error = f'HTTP {self.last_status}' if self.last_status >= 400 else None
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = repr(e)
+
+                if error is None:
+                    if self.failures and self.logger:
+                        self.logger.info(f'Status API reachable again after {self.failures} failed pushes')
+                    self.failures = 0
+                else:
+                    self.failures += 1
+                    if self.logger:
+                        self.logger.warning(f'Status API push failed ({self.failures} in a row): {error}')
+                await asyncio.sleep(self.next_delay())
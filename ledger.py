@@ -0,0 +1,358 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from mysql.connector import Error
+
+# ECONOMY LEDGER
+#
+# Write-behind cache for user_points. Commands read and change balances in
+# memory, every change is appended to a local journal first, and a background
+# task flushes the changes to MySQL in one transaction per `flush_interval`.
+#
+# Crash safety: the journal holds every change that isn't in MySQL yet. Each
+# journal entry has a sequence number, and the flush stores the last sequence
+# number it wrote in ledger_checkpoint in the same transaction. On startup the
+# journal is replayed, skipping everything up to the checkpoint, so no change
+# is lost or applied twice. Flushed entries can therefore stay in the journal;
+# it is only compacted down to the pending entries once `compact_after`
+# flushed entries have piled up, with the file written off the event loop.
+
+FIELDS = ('streak', 'last_collected', 'last_worked')
+
+
+class Account:
+    __slots__ = ('user_id', 'exists', 'points', 'streak', 'last_collected', 'last_worked')
+
+    def __init__(self, user_id, row=None):
+        self.user_id = user_id
+        self.exists = row is not None
+        self.points, self.streak, self.last_collected, self.last_worked = row if row else (0, 0, None, None)
+
+
+def _encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _decode(field, value):
+    return datetime.fromisoformat(value) if value is not None and field != 'streak' else value
+
+
+def load_account(cursor, user_id):
+    cursor.execute('SELECT points, streak, last_collected, last_worked FROM user_points WHERE user_id = %s', (user_id,))
+    return cursor.fetchone()
+
+
+def load_checkpoint(cursor):
+    cursor.execute('SELECT seq FROM ledger_checkpoint WHERE id = 1')
+    result = cursor.fetchone()
+    return result[0] if result else 0
+
+
+def write_changes(cursor, entries):
+    # Entries at or below the checkpoint are already in MySQL (e.g. a flush whose commit
+    # succeeded but whose reply got lost), so a batch can safely be written twice
+    cursor.execute('INSERT IGNORE INTO ledger_checkpoint (id, seq) VALUES (1, 0)')
+    cursor.execute('SELECT seq FROM ledger_checkpoint WHERE id = 1 FOR UPDATE')
+    checkpoint = cursor.fetchone()[0]
+    entries = [entry for entry in entries if entry['seq'] > checkpoint]
+    if not entries:
+        return 0
+
+    changes = {}  # user_id -> [points_delta, {field: value}]
+    for entry in entries:
+        change = changes.setdefault(entry['user'], [0, {}])
+        change[0] += entry['delta']
+        for field in FIELDS:
+            if field in entry:
+                change[1][field] = _decode(field, entry[field])
+
+    # One multi-row upsert per combination of changed fields, usually just one or two statements.
+    # Points are always added to the stored balance, never overwritten.
+    groups = {}
+    for user_id, (delta, fields) in changes.items():
+        changed = tuple(field for field in FIELDS if field in fields)
+        groups.setdefault(changed, []).append(
+            (user_id, delta, fields.get('streak', 0), fields.get('last_collected'), fields.get('last_worked'))
+        )
+    for changed, rows in groups.items():
+        updates = ', '.join(['points = points + VALUES(points)'] + [f'{field} = VALUES({field})' for field in changed])
+        cursor.executemany(
+            'INSERT INTO user_points (user_id, points, streak, last_collected, last_worked) VALUES (%s, %s, %s, %s, %s) '
+            f'ON DUPLICATE KEY UPDATE {updates}',
+            rows
+        )
+    cursor.execute('UPDATE ledger_checkpoint SET seq = %s WHERE id = 1', (entries[-1]['seq'],))
+    return len(entries)
+
+
+def _write_journal(path, entries):
+    with open(path, 'w', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Ledger:
+    def __init__(self, db, journal_path, flush_interval=1.0, max_batch=1000, max_accounts=50000, compact_after=10000, on_change=None, logger=None):
+        self.db = db
+        self.journal_path = journal_path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_accounts = max_accounts
+        self.compact_after = compact_after  # flushed entries left in the journal before it is compacted
+        self.on_change = on_change  # (user_id, points) after every balance change
+        self.logger = logger
+
+        self.flushes = 0
+        self.flushed_entries = 0
+
+        self._accounts = OrderedDict()  # user_id -> Account, least recently used first
+        self._loading = {}  # user_id -> task loading that account
+        self._pending = []  # journal entries not written to MySQL yet
+        self._dirty = {}  # user_id -> number of pending entries for that user
+        self._seq = 0
+        self._journal = None
+        self._flushed_in_journal = 0
+        self._ready = None
+        self._task = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_generation = 0
+
+    # STARTUP AND REPLAY
+
+    def _read_journal(self):
+        entries = []
+        if not os.path.exists(self.journal_path):
+            return entries
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from a crash mid-write, nothing after it was acknowledged
+                    break
+                # Operations that touch several accounts are written as one line
+                if isinstance(record, list):
+                    entries.extend(record)
+                else:
+                    entries.append(record)
+        return entries
+
+    async def _start(self):
+        os.makedirs(os.path.dirname(self.journal_path) or '.', exist_ok=True)
+        entries = await asyncio.to_thread(self._read_journal)
+        checkpoint = await self.db.run(load_checkpoint)
+        replay = [entry for entry in entries if entry['seq'] > checkpoint]
+        self._seq = max([checkpoint] + [entry['seq'] for entry in entries])
+
+        self._pending = replay
+        for entry in replay:
+            self._dirty[entry['user']] = self._dirty.get(entry['user'], 0) + 1
+        # Nothing can be journaled before the ledger is ready, so the snapshot is complete
+        await self._compact()
+        if replay:
+            if self.logger:
+                self.logger.info(f'Replaying {len(replay)} economy journal entries')
+            await self.flush()
+        self._task = asyncio.ensure_future(self._run())
+
+    def start(self):
+        if self._ready is None:
+            self._ready = asyncio.ensure_future(self._start())
+            self._ready.add_done_callback(self._started)
+        return self._ready
+
+    def _started(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            # Let the next command try again
+            if self.logger:
+                self.logger.error(f'Failed to start the economy ledger: {task.exception()}')
+            self._ready = None
+
+    async def ready(self):
+        await asyncio.shield(self.start())
+
+    # ACCOUNTS
+
+    async def _read_account(self, user_id):
+        # The row only matches the pending entries if no flush overlapped the query
+        for _ in range(3):
+            generation = self._flush_generation
+            busy = self._flush_lock.locked()
+            row = await self.db.run(load_account, user_id)
+            if not busy and not self._flush_lock.locked() and generation == self._flush_generation:
+                return row
+        async with self._flush_lock:
+            return await self.db.run(load_account, user_id)
+
+    async def _load(self, user_id):
+        try:
+            row = await self._read_account(user_id)
+            if user_id not in self._accounts:
+                account = Account(user_id, row)
+                # Changes replayed from the journal aren't in that row yet
+                for entry in self._pending:
+                    if entry['user'] == user_id:
+                        self._apply_entry(account, entry)
+                self._accounts[user_id] = account
+                self._evict()
+            return self._accounts[user_id]
+        finally:
+            self._loading.pop(user_id, None)
+
+    async def account(self, user_id):
+        await self.ready()
+        account = self._accounts.get(user_id)
+        if account is not None:
+            self._accounts.move_to_end(user_id)
+            return account
+        task = self._loading.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(user_id))
+            self._loading[user_id] = task
+        return await asyncio.shield(task)
+
+    def _evict(self):
+        # Accounts with changes that are not flushed yet stay in memory
+        while len(self._accounts) > self.max_accounts:
+            for user_id in self._accounts:
+                if user_id not in self._dirty:
+                    del self._accounts[user_id]
+                    break
+            else:
+                return
+
+    def _apply_entry(self, account, entry):
+        account.exists = True
+        account.points += entry['delta']
+        for field in FIELDS:
+            if field in entry:
+                setattr(account, field, _decode(field, entry[field]))
+
+    def _write(self, changes):
+        # changes: [(account, delta, fields)], journaled as one line so they are replayed all or nothing
+        entries = []
+        for account, delta, fields in changes:
+            self._seq += 1
+            entry = {'seq': self._seq, 'user': account.user_id, 'delta': delta}
+            for field, value in fields.items():
+                if field not in FIELDS:
+                    raise ValueError(f'Unknown account field: {field}')
+                entry[field] = _encode(value)
+            entries.append(entry)
+
+        self._journal.write(json.dumps(entries[0] if len(entries) == 1 else entries) + '\n')
+        self._journal.flush()
+        for (account, _, _), entry in zip(changes, entries):
+            self._apply_entry(account, entry)
+            self._pending.append(entry)
+            self._dirty[account.user_id] = self._dirty.get(account.user_id, 0) + 1
+            if self.on_change is not None:
+                self.on_change(account.user_id, account.points)
+
+    # BALANCE OPERATIONS
+    #
+    # These work on accounts loaded with account() and never await, so the balance
+    # check and the change can't interleave with another command.
+
+    def apply(self, account, delta=0, **fields):
+        # Unconditional change, e.g. a reward
+        self._write([(account, delta, fields)])
+        return account
+
+    def spend(self, account, cost, credits=(), **fields):
+        # Takes cost from account only if it has at least that many points, and pays out
+        # credits [(account, amount)] together with it. Returns False if nothing was changed.
+        if cost < 0 or account.points < cost:
+            return False
+        self._write([(account, -cost, fields)] + [(credited, amount, {}) for credited, amount in credits])
+        return True
+
+    # FLUSHING
+
+    async def _compact(self):
+        # Keeps only the entries that are not in MySQL yet. Called with the flush lock held
+        # (or before the ledger is ready), so _pending only grows while the file is written.
+        snapshot = list(self._pending)
+        tmp_path = self.journal_path + '.tmp'
+        await asyncio.to_thread(_write_journal, tmp_path, snapshot)
+
+        # Changes journaled meanwhile go after the snapshot, no await from here on
+        with open(tmp_path, 'a', encoding='utf-8') as f:
+            for entry in self._pending[len(snapshot):]:
+                f.write(json.dumps(entry) + '\n')
+        if self._journal is not None:
+            self._journal.close()
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        self._flushed_in_journal = 0
+
+    def _mark_flushed(self, last_seq):
+        count = 0
+        while count < len(self._pending) and self._pending[count]['seq'] <= last_seq:
+            user_id = self._pending[count]['user']
+            remaining = self._dirty[user_id] - 1
+            if remaining:
+                self._dirty[user_id] = remaining
+            else:
+                del self._dirty[user_id]
+            count += 1
+        if count:
+            del self._pending[:count]
+            self._flushed_in_journal += count
+        return count
+
+    async def flush(self):
+        if not self._pending:
+            return 0
+        async with self._flush_lock:
+            batch = self._pending[:self.max_batch]
+            if not batch:
+                return 0
+
+            # Make sure the batch is on disk before it goes to MySQL
+            await asyncio.to_thread(_fsync, self.journal_path)
+            await self.db.run(write_changes, batch)
+            self._flush_generation += 1
+
+            count = self._mark_flushed(batch[-1]['seq'])
+            self.flushes += 1
+            self.flushed_entries += count
+            if self._flushed_in_journal >= self.compact_after:
+                await self._compact()
+            return count
+
+    async def _run(self):
+        delay = self.flush_interval
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                started = time.monotonic()
+                await self.flush()
+                delay = max(0.0, self.flush_interval - (time.monotonic() - started)) if len(self._pending) < self.max_batch else 0
+            except Error as e:
+                # Everything is still in the journal, try again a bit later
+                if self.logger:
+                    self.logger.error(f'Failed to flush economy ledger ({len(self._pending)} pending): {e}')
+                delay = min(delay * 2, 30.0) if delay else self.flush_interval
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        while self._pending:
+            await self.flush()
+        if self._journal is not None:
+            self._journal.close()
@@ -0,0 +1,143 @@
+import copy
+import json
+import logging
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# LOGGING
+#
+# Log records are put on a queue and written to disk by a background thread,
+# so file writes and the midnight rollover never block the event loop. Before
+# a record is queued it can be sampled, and its message and traceback are
+# capped in size.
+
+CONTEXT_FIELDS = ('guild', 'user', 'command', 'latency_ms')
+
+
+def truncate(text, max_length):
+    if len(text) > max_length:
+        return f'{text[:max_length]}... [{len(text) - max_length} more characters]'
+    return text
+
+
+class DroppingQueueHandler(QueueHandler):
+    # Drops records instead of blocking when the writer thread can't keep up
+
+    def __init__(self, log_queue, max_length=4000):
+        super().__init__(log_queue)
+        self.max_length = max_length
+        self.dropped = 0
+
+    def prepare(self, record):
+        # QueueHandler would fold the traceback into the message. Keep it formatted in exc_text instead,
+        # capped like the message, so text formatters still append it and JsonFormatter writes it as `exception`.
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        record.exc_text = truncate(exc_text, self.max_length) if exc_text else None
+        record.stack_info = truncate(record.stack_info, self.max_length) if record.stack_info else None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class TruncatingFilter(logging.Filter):
+    def __init__(self, max_length=4000):
+        super().__init__()
+        self.max_length = max_length
+
+    def filter(self, record):
+        # Format once here, the writer thread only has to write it
+        record.msg = truncate(record.getMessage(), self.max_length)
+        record.args = None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    # rates: {logger name: fraction of records to keep}, warnings and errors are always kept
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def rate_for(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Records from the queue carry the traceback already formatted
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def parse_rates(value):
+    # "nexus.status=0.1,discord=0.5" -> {'nexus.status': 0.1, 'discord': 0.5}
+    rates = {}
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        name, _, rate = item.partition('=')
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+def interaction_context(interaction, **extra):
+    # Structured fields for a log call about an interaction: logger.info(..., extra=interaction_context(interaction))
+    context = {
+        'guild': interaction.guild.id if interaction.guild else None,
+        'user': interaction.user.id,
+        'command': interaction.command.qualified_name if interaction.command else None,
+    }
+    context.update(extra)
+    return context
+
+
+def start_queue_logging(logger, handlers, max_queue=10000, max_length=4000, sample_rates=None):
+    log_queue = queue.Queue(maxsize=max_queue)
+    queue_handler = DroppingQueueHandler(log_queue, max_length)
+    # Sample first, records that are dropped don't need to be formatted
+    if sample_rates:
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+    queue_handler.addFilter(TruncatingFilter(max_length))
+    logger.addHandler(queue_handler)
+    # A rate for a logger outside `logger`, e.g. discord=0.5, also sends that logger's records to the file.
+    # Nested names get the handler once, on the outermost one, their records reach it by propagation.
+    for name in sample_rates or ():
+        if not any(name == parent or name.startswith(parent + '.') for parent in [logger.name, *sample_rates] if parent != name):
+            logging.getLogger(name).addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return queue_handler, listener
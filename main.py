@@ -2,19 +2,34 @@ import os
 from dotenv import load_dotenv
 import discord
 from discord.ext import commands, tasks
+from discord import app_commands
 from datetime import timedelta, datetime
 import json
-import openai
 import asyncio
 import random
-import requests
 import logging
-import mysql.connector
 from mysql.connector import Error
 from logging.handlers import TimedRotatingFileHandler
-from uptime_kuma_api import UptimeKumaApi
-import sympy as sp
-import asyncio
+import atexit
+import importlib
+import time
+from wordfilter import BannedWordMatcher, MatcherCache
+from database import DatabasePool
+from entitlements import EntitlementIndex
+from ranking import PointsRanking, NameCache
+from ledger import Ledger
+from heartbeat import StatusHeartbeat
+from status_monitor import MonitorStatus
+from welcome import WelcomeTemplate, WelcomeConfig, JoinCoalescer
+from sticky import StickyRegistry
+from radio import RadioHub
+from voice import VoiceSessions
+from assistant import InFlightLimiter, StreamingReply, ResponseCache, ConversationMemory
+from command_sync import sync_if_changed
+from work_questions import QuestionPool, parse_answer
+from cooldowns import Cooldowns
+from log_handlers import JsonFormatter, parse_rates, start_queue_logging, interaction_context
+from metrics import MetricsRegistry, serve_metrics, instrument_events, instrument_http
 
 load_dotenv()
 
@@ -24,32 +39,40 @@ DB_USER = os.getenv("DB_USERNAME")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 
-api = UptimeKumaApi(os.getenv("UPTIME_KUMA_URL"))
-api.login(os.getenv("UPTIME_KUMA_USERNAME"), os.getenv("UPTIME_KUMA_PASSWORD"))
-
-def get_db_connection():
-    return mysql.connector.connect(
-        host=DB_HOST,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME
-    )
+# Shared connection pool, all queries run off the event loop
+db = DatabasePool(
+    min_size=int(os.getenv("DB_POOL_MIN", 2)),
+    max_size=int(os.getenv("DB_POOL_SIZE", 10)),
+    acquire_timeout=float(os.getenv("DB_POOL_TIMEOUT", 5)),
+    host=DB_HOST,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    database=DB_NAME
+)
 
-openai.api_key = os.getenv('OPENAI_API_KEY')
 
 FILTER = os.getenv('FILTER')
+FILTER_CACHE_MAX_STATES = int(os.getenv('FILTER_CACHE_MAX_STATES', 500000))
 TOKEN = os.getenv('DISCORD_BOT_TOKEN')
 
 # Create logs directory if it doesn't exist
 os.makedirs('logs', exist_ok=True)
 
 # Configure logging
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # text or json (one JSON object per line)
+LOG_MAX_MESSAGE = int(os.getenv('LOG_MAX_MESSAGE', 4000))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_SAMPLE = parse_rates(os.getenv('LOG_SAMPLE'))  # e.g. "nexus=0.5,discord=0.1", only applies below WARNING
+
 def setup_logger():
     logger = logging.getLogger('nexus')
     logger.setLevel(logging.INFO)
     
     # Create formatter
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    if LOG_FORMAT == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
     
     # Create daily rotating file handler
     log_file = f'logs/{datetime.now().strftime("%d.%m.%Y")}.log'
@@ -62,7 +85,15 @@ def setup_logger():
     )
     file_handler.setFormatter(formatter)
     
-    logger.addHandler(file_handler)
+    # The file is written by a background thread, logging calls only put the record on a queue
+    logger.log_queue, logger.log_listener = start_queue_logging(
+        logger,
+        [file_handler],
+        max_queue=LOG_QUEUE_SIZE,
+        max_length=LOG_MAX_MESSAGE,
+        sample_rates=LOG_SAMPLE
+    )
+    atexit.register(logger.log_listener.stop)
     return logger
 
 logger = setup_logger()
@@ -70,13 +101,79 @@ logger = setup_logger()
 with open('banned_words.json', 'r') as f:
     banned_words = json.load(f)['banned_words']
 
-# LOAD WELCOME MESSAGE AND CHANNEL ON BOT STARTUP
+# Compile the banned word list once so on_message only does a single pass per message
+banned_word_matcher = BannedWordMatcher(banned_words)
+
+# Compiled per-guild lists (default words + the guild's own words)
+guild_matchers = MatcherCache(banned_word_matcher, max_states=FILTER_CACHE_MAX_STATES)
+pending_guild_loads = set()
+# Guilds whose list failed to load, by when it failed, they use the default list until GUILD_LOAD_RETRY has passed
+failed_guild_loads = {}
+GUILD_LOAD_RETRY = 30
+
+def load_guild_banned_words(cursor, guild_id):
+    cursor.execute('SELECT version FROM guild_word_list_versions WHERE guild_id = %s', (guild_id,))
+    result = cursor.fetchone()
+    version = result[0] if result else 0
+    cursor.execute('SELECT word FROM guild_banned_words WHERE guild_id = %s', (guild_id,))
+    words = [row[0] for row in cursor.fetchall()]
+    return version, words
+
+def edit_guild_banned_word(cursor, guild_id, word, add):
+    if add:
+        cursor.execute('INSERT IGNORE INTO guild_banned_words (guild_id, word) VALUES (%s, %s)', (guild_id, word))
+    else:
+        cursor.execute('DELETE FROM guild_banned_words WHERE guild_id = %s AND word = %s', (guild_id, word))
+    changed = cursor.rowcount > 0
+    # Bump the list version in the same transaction so cached matchers go stale
+    cursor.execute(
+        'INSERT INTO guild_word_list_versions (guild_id, version) VALUES (%s, 1) ON DUPLICATE KEY UPDATE version = version + 1',
+        (guild_id,)
+    )
+    version, words = load_guild_banned_words(cursor, guild_id)
+    return changed, version, words
+
+async def load_guild_matcher(guild_id):
+    try:
+        version, words = await db.run(load_guild_banned_words, guild_id)
+        # A moderator edit may have already stored a newer list while we were loading
+        if guild_matchers.get(guild_id) is None:
+            guild_matchers.put(guild_id, version, words)
+        failed_guild_loads.pop(guild_id, None)
+    except Error as e:
+        failed_guild_loads[guild_id] = time.monotonic()
+        bot.logger.error(f"Database error loading banned words for guild {guild_id}: {e}")
+    finally:
+        pending_guild_loads.discard(guild_id)
+
+def get_guild_matcher(guild):
+    if guild is None:
+        return banned_word_matcher
+    matcher = guild_matchers.get(guild.id)
+    if matcher is None:
+        # Never hit the database on the message path, use the default list until the guild's list is loaded
+        failed_at = failed_guild_loads.get(guild.id)
+        if failed_at is not None and time.monotonic() - failed_at < GUILD_LOAD_RETRY:
+            return banned_word_matcher
+        if guild.id not in pending_guild_loads:
+            pending_guild_loads.add(guild.id)
+            asyncio.create_task(load_guild_matcher(guild.id))
+        return banned_word_matcher
+    return matcher
+
+# LOAD LEGACY WELCOME MESSAGE ON BOT STARTUP
+# welcome_message.json is only read once, it is used for the guild that owns its channel until /setwelcome is run there
 def load_welcome_data():
     if os.path.exists('welcome_message.json'):
         with open('welcome_message.json', 'r') as f:
-            return json.load(f)
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                pass
     return {"channel_id": None, "welcome_message": None}
 
+legacy_welcome_data = load_welcome_data()
+
 with open('help.json', 'r') as f:
     help_commands = json.load(f)
 
@@ -87,22 +184,256 @@ bot.logger = logger
 
 tree = bot.tree
 
+# METRICS
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9464))  # 0 turns the endpoint off
+
+# Served in Prometheus' format on http://METRICS_HOST:METRICS_PORT/metrics
+metrics = MetricsRegistry(prefix='nexus_')
+command_seconds = metrics.histogram('command_duration_seconds', 'Time from a slash command reaching the bot until it finished.', ['command'])
+command_errors = metrics.counter('command_errors_total', 'Slash commands that failed, including failed checks such as cooldowns.', ['command', 'error'])
+event_seconds = metrics.histogram('event_duration_seconds', 'Time spent in gateway event handlers.', ['event'])
+event_errors = metrics.counter('event_errors_total', 'Gateway event handlers that raised an exception.', ['event'])
+rest_seconds = metrics.histogram('rest_request_duration_seconds', 'Discord API requests by route, including rate limit waits.', ['method', 'route'])
+rest_errors = metrics.counter('rest_errors_total', 'Discord API requests that failed.', ['method', 'route', 'status'])
+db_query_seconds = metrics.histogram('db_query_duration_seconds', 'Database transaction time.')
+db_wait_seconds = metrics.histogram('db_wait_duration_seconds', 'Time spent waiting for a pooled database connection.')
+filter_messages = metrics.counter('filter_messages_total', 'Messages checked for banned words.')
+filter_hits = metrics.counter('filter_hits_total', 'Messages deleted for containing a banned word.')
+metrics.gauge('guilds', 'Servers the bot is in.', collect=lambda: len(bot.guilds))
+metrics.gauge('gateway_latency_seconds', 'Gateway heartbeat latency.', collect=lambda: bot.latency)
+
+def db_connections():
+    stats = db.stats()
+    return {'idle': stats['idle'], 'busy': stats['size'] - stats['idle']}
+
+metrics.gauge('db_connections', 'Open database connections.', ['state'], collect=db_connections)
+metrics.gauge('db_waiting', 'Commands waiting for a database connection.', collect=lambda: db.stats()['waiting'])
+metrics.counter('log_records_dropped_total', 'Log records dropped because the log queue was full.', collect=lambda: logger.log_queue.dropped)
+
+db.query_stats.observe = db_query_seconds.observe
+db.wait_stats.observe = db_wait_seconds.observe
+instrument_http(bot.http, rest_seconds, rest_errors)
+
+async def start_command_timer(interaction: discord.Interaction):
+    interaction.extras['started'] = time.perf_counter()
+    return True
+
+# Runs before every slash command, on_app_command_completion and the error handler stop the timer
+tree.interaction_check = start_command_timer
+
+def record_command(interaction, error=None):
+    command_name = interaction.command.qualified_name if interaction.command else 'unknown'
+    started = interaction.extras.get('started')
+    if started is not None:
+        command_seconds.labels(command_name).observe(time.perf_counter() - started)
+    if error is not None:
+        command_errors.labels(command_name, type(getattr(error, 'original', error)).__name__).inc()
+
+# PREMIUM CHECK
+
+PREMIUM_SKU_ID = 1347585991975637132
+
+async def fetch_premium_entitlements():
+    return [e async for e in bot.entitlements(limit=None, skus=[discord.Object(id=PREMIUM_SKU_ID)])]
+
+# Premium users indexed by user id, kept current from the gateway entitlement events
+entitlements = EntitlementIndex(PREMIUM_SKU_ID, fetch_premium_entitlements, ttl=600, logger=logger)
+
+class PremiumRequired(app_commands.CheckFailure):
+    pass
+
+async def is_premium(user):
+    # Users count as not premium while the entitlements can't be loaded
+    try:
+        return await entitlements.has_premium(user.id)
+    except Exception as e:
+        bot.logger.warning(f"Failed to check premium status of {user}: {e}")
+        return False
+
+def premium_only():
+    async def predicate(interaction: discord.Interaction):
+        if not await is_premium(interaction.user):
+            raise PremiumRequired()
+        return True
+    return app_commands.check(predicate)
+
+# COOLDOWNS
+
+cooldowns = Cooldowns(max_entries=100000)
+
+class OnCooldown(app_commands.CheckFailure):
+    def __init__(self, retry_after, title, message):
+        super().__init__(f'On cooldown for {retry_after:.0f}s')
+        self.retry_after = retry_after
+        self.title = title
+        self.message = message
+
+class CooldownUnavailable(app_commands.CheckFailure):
+    pass
+
+def cooldown(name, seconds, load=None, start=True, title='Slow Down', message=None):
+    # Rejects the command while the user's cooldown `name` is running, without a database query once the user is known.
+    # load(user_id) returns when an existing cooldown ends (unix time) for users that aren't in memory yet.
+    # With start=False the command starts the cooldown itself with cooldowns.start(), e.g. only when it succeeded.
+    async def predicate(interaction: discord.Interaction):
+        try:
+            retry_after = await cooldowns.remaining(name, interaction.user.id, load)
+        except Exception as e:
+            # A failed load isn't an AppCommandError, the user would get no response at all
+            bot.logger.error(f"Failed to load the {name} cooldown of {interaction.user}: {e}")
+            raise CooldownUnavailable() from e
+        if retry_after:
+            raise OnCooldown(retry_after, title, message)
+        if start:
+            cooldowns.start(name, interaction.user.id, seconds)
+        return True
+    return app_commands.check(predicate)
+
+@tree.error
+async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    record_command(interaction, error)
+    if isinstance(error, PremiumRequired):
+        error_embed = discord.Embed(title='Error', description='❌ You do not have an active subscription.', color=discord.Color.red())
+        await interaction.response.send_message(embed=error_embed)
+        return
+    if isinstance(error, app_commands.MissingPermissions):
+        error_embed = discord.Embed(title='Error', description='❌ You do not have permission to use this command.', color=discord.Color.red())
+        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        return
+    if isinstance(error, app_commands.NoPrivateMessage):
+        await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
+        return
+    if isinstance(error, OnCooldown):
+        hours = int(error.retry_after // 3600)
+        minutes = int((error.retry_after % 3600) // 60)
+        description = error.message or f"You need to wait {hours}h {minutes}m before using /{interaction.command.name} again!"
+        embed = discord.Embed(title=error.title, description=description.format(hours=hours, minutes=minutes), color=discord.Color.red())
+        await interaction.response.send_message(embed=embed)
+        return
+    if isinstance(error, CooldownUnavailable):
+        error_embed = discord.Embed(title='Error', description='❌ Error checking your cooldown. Please try again later.', color=discord.Color.red())
+        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        return
+    command_name = interaction.command.name if interaction.command else 'unknown'
+    bot.logger.error(f'Error in command /{command_name}: {error}', exc_info=error, extra=interaction_context(interaction))
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    record_command(interaction)
+    # One structured record per command with how long it took from the user's click
+    latency_ms = round((discord.utils.utcnow() - interaction.created_at).total_seconds() * 1000, 1)
+    bot.logger.info(
+        f'/{command.qualified_name} by {interaction.user} completed in {latency_ms}ms',
+        extra=interaction_context(interaction, command=command.qualified_name, latency_ms=latency_ms)
+    )
+
+@bot.event
+async def on_entitlement_create(entitlement):
+    entitlements.add(entitlement)
+
+@bot.event
+async def on_entitlement_update(entitlement):
+    entitlements.add(entitlement)
+
+@bot.event
+async def on_entitlement_delete(entitlement):
+    entitlements.remove(entitlement)
+
 # UPDATE PRESENCE
 
+# Uptime Kuma monitors for /status, refreshed in the background after the bot is ready
+monitor_status = MonitorStatus(
+    os.getenv("UPTIME_KUMA_URL"),
+    os.getenv("UPTIME_KUMA_USERNAME"),
+    os.getenv("UPTIME_KUMA_PASSWORD"),
+    refresh_interval=60,
+    logger=logger
+)
+
+status_heartbeat = StatusHeartbeat('https://status.syncwi.de/api/push/SEu8vCo9vY', interval=60, logger=logger)
+bot.presence_guild_count = None
+
 @tasks.loop(seconds=60)
 async def update_presence():
-    response = requests.get('https://status.syncwi.de/api/push/SEu8vCo9vY')
-    bot.logger.info(f'Status API Response: {response.status_code}')
-    await bot.change_presence(activity=discord.Game(name=f'Currently on {len(bot.guilds)} servers!'))
+    # Only send a presence update to the gateway when the server count changed
+    guild_count = len(bot.guilds)
+    if guild_count == bot.presence_guild_count:
+        return
+    await bot.change_presence(activity=discord.Game(name=f'Currently on {guild_count} servers!'))
+    bot.presence_guild_count = guild_count
+
+# DATABASE POOL STATS
+
+@tasks.loop(minutes=10)
+async def log_db_stats():
+    stats = db.stats()
+    wait = stats['wait']
+    query = stats['query']
+    bot.logger.info(
+        f"DB pool: {stats['size']} open, {stats['idle']} idle, {stats['waiting']} waiting, {stats['timeouts']} timeouts | "
+        f"wait avg {wait['avg_ms']:.1f}ms p95 {wait['p95_ms']:.1f}ms max {wait['max_ms']:.1f}ms | "
+        f"query avg {query['avg_ms']:.1f}ms p95 {query['p95_ms']:.1f}ms max {query['max_ms']:.1f}ms ({query['count']} total)"
+    )
+    if logger.log_queue.dropped:
+        bot.logger.warning(f'Dropped {logger.log_queue.dropped} log records because the log queue was full')
 
 # BOT STARTUP
 
+# Hash of the last synced command set, commands are only uploaded again when they change
+COMMAND_MANIFEST = os.getenv('COMMAND_MANIFEST', 'data/command_manifest.json')
+bot.started = False
+
+# Modules only some commands need, imported in the background once the bot is ready
+# so they don't slow down startup and the first command using them doesn't wait either
+WARM_UP_MODULES = ['openai']
+
+async def warm_up():
+    for name in WARM_UP_MODULES:
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(importlib.import_module, name)
+        except ImportError as e:
+            bot.logger.error(f'Failed to import {name}: {e}')
+            continue
+        bot.logger.info(f'Imported {name} in {(time.perf_counter() - started) * 1000:.0f}ms')
+
 @bot.event
 async def on_ready():
     bot.logger.info(f'{bot.user.name} has connected to Discord!')
     bot.logger.info(f'The bot is in {len(bot.guilds)} servers.')
-    await tree.sync()
-    await update_presence.start()
+    # A new gateway session starts without an activity, let update_presence send it again
+    bot.presence_guild_count = None
+    # on_ready fires again every time the gateway reconnects, everything below only needs to run once
+    if bot.started:
+        return
+    bot.started = True
+    try:
+        await db.warm()
+    except Error as e:
+        bot.logger.error(f"Failed to open database connections: {e}")
+    if METRICS_PORT:
+        try:
+            bot.metrics_server = await serve_metrics(metrics, METRICS_HOST, METRICS_PORT)
+            bot.logger.info(f'Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics')
+        except OSError as e:
+            bot.logger.error(f'Failed to start the metrics endpoint on {METRICS_HOST}:{METRICS_PORT}: {e}')
+    if not log_db_stats.is_running():
+        log_db_stats.start()
+    if not save_ai_cache.is_running():
+        save_ai_cache.start()
+    ledger.start()
+    voice_sessions.start()
+    status_heartbeat.start()
+    monitor_status.start()
+    try:
+        await sync_if_changed(tree, bot.user.id, COMMAND_MANIFEST, logger=bot.logger)
+    except discord.HTTPException as e:
+        bot.logger.error(f'Failed to sync application commands: {e}')
+    # start() returns the loop's task, awaiting it would keep on_ready from ever returning
+    update_presence.start()
+    asyncio.ensure_future(warm_up())
 
 # WORD FILTERING
 
@@ -114,34 +445,167 @@ async def on_message(message):
         if message.author == bot.user:
             return
 
-        msg_content = message.content.lower()
-        for word in banned_words:
-            if word.lower() in msg_content:
-                await message.delete()
-                bot.logger.warning(f'Deleted message from {message.author} containing banned word: {word}')
-                embed = discord.Embed(
-                    title="Message Deleted",
-                    description=f"Your message contained a banned word.",
-                    color=discord.Color.red()
-                )
-                await message.channel.send(embed=embed, delete_after=5)
-                return
+        filter_messages.inc()
+        word = get_guild_matcher(message.guild).search(message.content)
+        if word is not None:
+            filter_hits.inc()
+            await message.delete()
+            bot.logger.warning(f'Deleted message from {message.author} containing banned word: {word}')
+            embed = discord.Embed(
+                title="Message Deleted",
+                description=f"Your message contained a banned word.",
+                color=discord.Color.red()
+            )
+            await message.channel.send(embed=embed, delete_after=5)
+            return
+
+        # Repost the channel's sticky message if it has one
+        sticky_messages.dispatch(message)
 
         await bot.process_commands(message)
 
+# BANNED WORDS COMMANDS
+
+@tree.command(name='addbannedword', description='Adds a word to this server\'s banned word list.')
+@app_commands.guild_only()
+@app_commands.default_permissions(manage_messages=True)
+@app_commands.checks.has_permissions(manage_messages=True)
+async def add_banned_word(interaction: discord.Interaction, word: str):
+    word = word.strip().lower()
+    if not word:
+        await interaction.response.send_message("The banned word can't be empty.", ephemeral=True)
+        return
+    try:
+        changed, version, words = await db.run(edit_guild_banned_word, interaction.guild.id, word, True)
+    except Error as e:
+        bot.logger.error(f"Database error in addbannedword: {e}")
+        await interaction.response.send_message("Error updating the banned word list. Please try again later.", ephemeral=True)
+        return
+
+    # Recompile right away so the next message already uses the new list
+    guild_matchers.put(interaction.guild.id, version, words)
+    bot.logger.info(f'{interaction.user} added banned word {word} in server {interaction.guild.name}')
+    embed = discord.Embed(
+        title="Banned Word Added" if changed else "Banned Word Already Listed",
+        description=f"`{word}` is on this server's banned word list.",
+        color=discord.Color.green()
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@tree.command(name='removebannedword', description='Removes a word from this server\'s banned word list.')
+@app_commands.guild_only()
+@app_commands.default_permissions(manage_messages=True)
+@app_commands.checks.has_permissions(manage_messages=True)
+async def remove_banned_word(interaction: discord.Interaction, word: str):
+    word = word.strip().lower()
+    try:
+        changed, version, words = await db.run(edit_guild_banned_word, interaction.guild.id, word, False)
+    except Error as e:
+        bot.logger.error(f"Database error in removebannedword: {e}")
+        await interaction.response.send_message("Error updating the banned word list. Please try again later.", ephemeral=True)
+        return
+
+    guild_matchers.put(interaction.guild.id, version, words)
+    bot.logger.info(f'{interaction.user} removed banned word {word} in server {interaction.guild.name}')
+    embed = discord.Embed(
+        title="Banned Word Removed" if changed else "Banned Word Not Found",
+        description=f"`{word}` is not on this server's banned word list.",
+        color=discord.Color.green() if changed else discord.Color.red()
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@tree.command(name='bannedwords', description='Shows this server\'s own banned words.')
+@app_commands.guild_only()
+@app_commands.default_permissions(manage_messages=True)
+@app_commands.checks.has_permissions(manage_messages=True)
+async def list_banned_words(interaction: discord.Interaction):
+    try:
+        _, words = await db.run(load_guild_banned_words, interaction.guild.id)
+    except Error as e:
+        bot.logger.error(f"Database error in bannedwords: {e}")
+        await interaction.response.send_message("Error fetching the banned word list. Please try again later.", ephemeral=True)
+        return
+
+    description = ', '.join(f'`{w}`' for w in sorted(words)) if words else "This server has no banned words of its own."
+    embed = discord.Embed(title="Server Banned Words", description=description[:4096], color=discord.Color.blue())
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 # SEND WELCOME MESSAGE ON MEMBER JOIN
+
+# Write-through cache of the welcome settings, guild_id -> WelcomeConfig (None when the guild has none)
+welcome_configs = {}
+
+def load_welcome_config(cursor, guild_id):
+    cursor.execute('SELECT channel_id, message FROM guild_welcome WHERE guild_id = %s', (guild_id,))
+    return cursor.fetchone()
+
+async def fetch_welcome_config(guild):
+    result = await db.run(load_welcome_config, guild.id)
+    if result:
+        config = WelcomeConfig(result[0], WelcomeTemplate(result[1]))
+    elif legacy_welcome_data.get("channel_id") and legacy_welcome_data.get("welcome_message") and guild.get_channel(legacy_welcome_data["channel_id"]):
+        # welcome_message.json from before /setwelcome, only used when it has both fields
+        config = WelcomeConfig(legacy_welcome_data["channel_id"], WelcomeTemplate(legacy_welcome_data["welcome_message"]))
+    else:
+        config = None
+    # /setwelcome may have stored a newer config while this was loading
+    return welcome_configs.setdefault(guild.id, config)
+
+welcome_loads = {}
+
+async def get_welcome_config(guild):
+    if guild.id in welcome_configs:
+        return welcome_configs[guild.id]
+
+    # Joins that arrive while the config is loading share the same query
+    task = welcome_loads.get(guild.id)
+    if task is None:
+        task = asyncio.ensure_future(fetch_welcome_config(guild))
+        welcome_loads[guild.id] = task
+        task.add_done_callback(lambda _: welcome_loads.pop(guild.id, None))
+    return await asyncio.shield(task)
+
+async def send_welcome(guild_id, members, total):
+    config = welcome_configs.get(guild_id)
+    channel = bot.get_channel(config.channel_id) if config else None
+    if not channel:
+        return
+
+    guild = members[0].guild
+    if total == 1:
+        user_name = members[0].name
+        user_mention = members[0].mention
+    else:
+        # Join burst, welcome everyone in one message
+        user_name = ', '.join(member.name for member in members)
+        user_mention = ', '.join(member.mention for member in members)
+        if total > len(members):
+            user_name += f' and {total - len(members)} more'
+            user_mention += f' and {total - len(members)} more'
+
+    formatted_message = config.template.render(
+        user_name=user_name,
+        user_mention=user_mention,
+        guild_name=guild.name,
+        member_count=guild.member_count
+    )
+    try:
+        await channel.send(formatted_message[:2000])
+    except discord.HTTPException as e:
+        bot.logger.error(f'Failed to send welcome message in {guild.name}: {e}')
+
+welcome_bursts = JoinCoalescer(send_welcome, window=5.0, logger=logger)
+
 @bot.event
 async def on_member_join(member):
-    welcome_data = load_welcome_data()
-    channel_id = welcome_data.get("channel_id")
-    welcome_message = welcome_data.get("welcome_message")
+    try:
+        config = await get_welcome_config(member.guild)
+    except Error as e:
+        bot.logger.error(f"Database error loading welcome message for {member.guild.name}: {e}")
+        return
 
-    if channel_id and welcome_message:
-        channel = bot.get_channel(channel_id)
-        if channel:
-            # Replace placeholders with actual values
-            formatted_message = welcome_message.replace("%user_name%", member.name).replace("%guild_name%", member.guild.name)
-            await channel.send(formatted_message)
+    if config:
+        welcome_bursts.add(member.guild.id, member)
 
 # TEST COMMANDS
 
@@ -155,8 +619,7 @@ async def ping(interaction: discord.Interaction):
 
 # HELP COMMAND
 
-@tree.command(name='help', description='Displays a list of available commands and descriptions.')
-async def help(interaction: discord.Interaction):
+def build_help_embed():
     help_embed = discord.Embed(title="Bot Commands", color=discord.Color.blue())
 
     # Loop through the help_commands dictionary and add each command to the embed
@@ -165,8 +628,11 @@ async def help(interaction: discord.Interaction):
         usage = details.get("usage", None)
         field_value = f"{description}\n**Usage:** {usage}" if usage else description
         help_embed.add_field(name=command, value=field_value, inline=False)
+    return help_embed
 
-    await interaction.response.send_message(embed=help_embed)
+@tree.command(name='help', description='Displays a list of available commands and descriptions.')
+async def help(interaction: discord.Interaction):
+    await interaction.response.send_message(embed=build_help_embed())
 
 # VERSION COMMAND
 
@@ -181,18 +647,17 @@ async def version(interaction: discord.Interaction):
 async def status(interaction: discord.Interaction):
     embed = discord.Embed(title="SyncWide Solutions Status", color=discord.Color.green())
     
-    # Fetch the server statuses from Uptime Kuma
-    try:
-        servers = api.get_monitors()  # Call without await if it's synchronous
-        bot.logger.info(f"Fetched servers: {servers}")  # Log the fetched server data
-
-        for server in servers:
-            # Use the 'active' key to determine the server status
-            server_status = "Online" if server['active'] else "Offline"
-            embed.add_field(name=server['name'], value=f"Status: {server_status}", inline=False)
-    except Exception as e:
-        embed.description = "Failed to fetch server statuses."
-        bot.logger.error(f"Error fetching server statuses: {e}")
+    # Served from the snapshot kept by monitor_status, no request to Uptime Kuma here
+    age = monitor_status.age
+    if age is None:
+        embed.description = "Failed to fetch server statuses." if monitor_status.last_error else "Server statuses are still loading, try again in a moment."
+    else:
+        for name, value in monitor_status.fields:
+            embed.add_field(name=name, value=value, inline=False)
+        footer = f"Updated {int(age)} seconds ago"
+        if monitor_status.last_error:
+            footer += " (latest refresh failed)"
+        embed.set_footer(text=footer)
 
     await interaction.response.send_message(embed=embed)
 
@@ -253,44 +718,47 @@ async def unban(interaction: discord.Interaction, member: discord.Member):
 
 # TIMEOUT COMMAND
 
-@tree.command(name='timeout', description='Timeouts a user on this server. Use format: 1d, 1w, 1m, 1y, 1h, 1min, 1sec')
-@commands.has_permissions(moderate_members=True)
-async def timeout(interaction: discord.Interaction, member: discord.Member, duration: str, reason: str = 'No reason provided.'):
-    # More precise time units mapping
-    time_units = {
-        's': 1,
-        'sec': 1,
-        'second': 1,
-        'seconds': 1,
-        'm': 60,
-        'min': 60,
-        'minute': 60,
-        'minutes': 60,
-        'h': 3600,
-        'hour': 3600,
-        'hours': 3600,
-        'd': 86400,
-        'day': 86400,
-        'days': 86400,
-        'w': 604800,
-        'week': 604800,
-        'weeks': 604800
-    }
-    
-    # Extract number and unit from duration string
+# More precise time units mapping
+TIME_UNITS = {
+    's': 1,
+    'sec': 1,
+    'second': 1,
+    'seconds': 1,
+    'm': 60,
+    'min': 60,
+    'minute': 60,
+    'minutes': 60,
+    'h': 3600,
+    'hour': 3600,
+    'hours': 3600,
+    'd': 86400,
+    'day': 86400,
+    'days': 86400,
+    'w': 604800,
+    'week': 604800,
+    'weeks': 604800
+}
+
+def parse_duration(duration):
+    # '30s', '2h', '1min' -> seconds, ValueError with a message for the user otherwise
     amount = ''.join(filter(str.isdigit, duration))
     unit = ''.join(filter(str.isalpha, duration.lower()))
-    
+
     if not amount or not unit:
-        await interaction.response.send_message("Invalid format! Example: 1min, 30s, 2h, 1d")
-        return
-        
-    if unit not in time_units:
-        await interaction.response.send_message("Invalid time unit! Use: s/sec, m/min, h/hour, d/day, w/week")
+        raise ValueError("Invalid format! Example: 1min, 30s, 2h, 1d")
+    if unit not in TIME_UNITS:
+        raise ValueError("Invalid time unit! Use: s/sec, m/min, h/hour, d/day, w/week")
+    return int(amount) * TIME_UNITS[unit]
+
+@tree.command(name='timeout', description='Timeouts a user on this server. Use format: 1d, 1w, 1m, 1y, 1h, 1min, 1sec')
+@commands.has_permissions(moderate_members=True)
+async def timeout(interaction: discord.Interaction, member: discord.Member, duration: str, reason: str = 'No reason provided.'):
+    try:
+        seconds = parse_duration(duration)
+    except ValueError as e:
+        await interaction.response.send_message(str(e))
         return
-        
-    seconds = int(amount) * time_units[unit]
-    timeout_until = discord.utils.now(datetime.timezone.utc) + timedelta(seconds=seconds)
+    timeout_until = discord.utils.utcnow() + timedelta(seconds=seconds)
 
     try:
         dm = await member.create_dm()
@@ -336,33 +804,33 @@ async def serverinfo(interaction: discord.Interaction):
 
 # STICK COMMAND
 
-# Create a dictionary to hold sticky messages for each user
-sticky_messages = {}
+# Sticky messages by channel, reposted at most once every 10 seconds
+sticky_messages = StickyRegistry(interval=10.0, max_channels=5000, logger=logger)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    ai_memory.clear(channel.id)
+    conversation_channels.pop(channel.id, None)
+    await sticky_messages.unstick(channel.id)
 
 @tree.command(name='stick', description='Makes a sticky message.')
 @commands.has_permissions(manage_messages=True)
 async def stick(interaction: discord.Interaction, *, content: str):
+    if sticky_messages.is_full(interaction.channel.id):
+        embed = discord.Embed(
+            title="Sticky Message Not Created",
+            description="Too many channels have a sticky message right now. Please try again later.",
+            color=discord.Color.red()
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+
     # Acknowledge the command
     await interaction.response.send_message(content, ephemeral=True)  
-    await interaction.channel.purge(limit=1)  # Purge the user's command message
-
-    # Send the sticky message
-    sticky_message = await interaction.channel.send(content)
-
-    # Store the sticky message in the dictionary
-    sticky_messages[interaction.user.id] = sticky_message
 
-    # Function to delete the sticky message if a new message is sent
-    async def on_message(message):
-        if message.author.id == interaction.user.id:
-            # Check if the sticky message exists
-            if interaction.user.id in sticky_messages:
-                await sticky_messages[interaction.user.id].delete()
-                # Send a new sticky message
-                sticky_messages[interaction.user.id] = await interaction.channel.send(content)
-
-    # Add the message event listener
-    bot.add_listener(on_message, 'on_message')
+    # Send the sticky message, this replaces any earlier sticky message in the channel
+    await sticky_messages.stick(interaction.channel, content, interaction.user.id)
+    bot.logger.info(f'{interaction.user} stuck a message in {interaction.channel.name} on server {interaction.guild.name}')
 
     embed = discord.Embed(
         title="Sticky Message Created",
@@ -373,28 +841,21 @@ async def stick(interaction: discord.Interaction, *, content: str):
 
 # UNSTICK COMMAND
 
-@tree.command(name='unstick', description='Removes your sticky message.')
+@tree.command(name='unstick', description='Removes the sticky message of this channel.')
 @commands.has_permissions(manage_messages=True)
 async def unstick(interaction: discord.Interaction):
-    user_id = interaction.user.id
-
-    # Check if the user has a sticky message
-    if user_id in sticky_messages:
-        # Delete the sticky message
-        await sticky_messages[user_id].delete()
-        # Remove the sticky message from the dictionary
-        del sticky_messages[user_id]
-
+    # Check if the channel has a sticky message
+    if await sticky_messages.unstick(interaction.channel.id):
         embed = discord.Embed(
             title="Sticky Message Removed",
-            description="Your sticky message has been removed.",
+            description="The sticky message of this channel has been removed.",
             color=discord.Color.green()
         )
         await interaction.response.send_message(embed=embed)
     else:
         embed = discord.Embed(
             title="No Sticky Message Found",
-            description="You don't have a sticky message to remove.",
+            description="This channel doesn't have a sticky message to remove.",
             color=discord.Color.red()
         )
         await interaction.response.send_message(embed=embed)
@@ -404,19 +865,24 @@ async def unstick(interaction: discord.Interaction):
 @tree.command(name='setwelcome', description='Set the welcome message and channel for new members.')
 @commands.has_permissions(manage_guild=True)
 async def set_welcome(interaction: discord.Interaction, channel: discord.TextChannel, *, message: str = None):
+    welcome_message = message if message else "Welcome to the server!"
 
-    welcome_data = {
-        "channel_id": channel.id,
-        "welcome_message": message if message else "Welcome to the server!"
-    }
-
-    # Save the welcome message and channel ID to a JSON file
-    with open('welcome_message.json', 'w') as f:
-        json.dump(welcome_data, f)
+    # Save the welcome message and channel ID, then update the cache
+    try:
+        await db.execute(
+            'INSERT INTO guild_welcome (guild_id, channel_id, message) VALUES (%s, %s, %s) '
+            'ON DUPLICATE KEY UPDATE channel_id = VALUES(channel_id), message = VALUES(message)',
+            (interaction.guild.id, channel.id, welcome_message)
+        )
+    except Error as e:
+        bot.logger.error(f"Database error in setwelcome: {e}")
+        await interaction.response.send_message("Error saving the welcome message. Please try again later.")
+        return
+    welcome_configs[interaction.guild.id] = WelcomeConfig(channel.id, WelcomeTemplate(welcome_message))
 
     embed = discord.Embed(
         title="Welcome Message Set",
-        description=f"The welcome message has been set to:\n{welcome_data['welcome_message']}\nIn channel: {channel.mention}",
+        description=f"The welcome message has been set to:\n{welcome_message}\nIn channel: {channel.mention}",
         color=discord.Color.green()
     )
     await interaction.response.send_message(embed=embed)
@@ -499,184 +965,354 @@ async def create_embed(interaction: discord.Interaction, title: str = None, desc
 
 @tree.command(name='check', description='Checks for an active subscription.')
 async def check_subscription(interaction: discord.Interaction):
-    application_id = bot.application_id  # Get the bot's application ID
-    user_id = interaction.user.id
-
-    # Manually fetch entitlements using the bot's HTTP client
-    data = await bot.http.get_entitlements(application_id)
-
-    if not data:
-        not_data_embed = discord.Embed(title='Error', description='❌ No entitlements found.', color=discord.Color.red())
-        await interaction.response.send_message(embed=not_data_embed)
+    try:
+        active = await entitlements.has_premium(interaction.user.id)
+    except Exception as e:
+        bot.logger.error(f"Failed to check premium status of {interaction.user}: {e}")
+        error_embed = discord.Embed(title='Error', description='❌ Could not check your subscription. Please try again later.', color=discord.Color.red())
+        await interaction.response.send_message(embed=error_embed, ephemeral=True)
+        return
+    if active:
+        active_embed = discord.Embed(title='Success', description='✅ You have an active subscription!', color=discord.Color.green())
+        await interaction.response.send_message(embed=active_embed)
         return
-
-    # Check if user has an active entitlement
-    for entitlement in data:
-        if entitlement["user_id"] == str(user_id) and entitlement["sku_id"] == "1347585991975637132":
-            active_embed = discord.Embed(title='Success', description='✅ You have an active subscription!', color=discord.Color.green())
-            await interaction.response.send_message(embed=active_embed)
-            return
 
     not_active_embed = discord.Embed(title='Error', description='❌ No entitlements found.', color=discord.Color.red())
     await interaction.response.send_message(embed=not_active_embed)
 
 # RADIO COMMAND
 
-@tree.command(name='radio', description='Plays a radio station.')
-async def radio(interaction: discord.Interaction, station: str = 'http://radio.syncwi.de:8000/stream.aac'):
-    application_id = bot.application_id  # Get the bot's application ID
-    user_id = interaction.user.id
-
-    # Manually fetch entitlements using the bot's HTTP client
-    data = await bot.http.get_entitlements(application_id)
-
-    if not data:
-        not_data_embed = discord.Embed(title='Error', description='❌ No entitlements found.', color=discord.Color.red())
-        await interaction.response.send_message(embed=not_data_embed)
-        return
+# One FFmpeg process per station, fanned out to every voice client playing it
+radio_hub = RadioHub(bitrate=128)
 
-    # Check if user has an active entitlement
-    has_subscription = any(entitlement["user_id"] == str(user_id) and entitlement["sku_id"] == "1347585991975637132" for entitlement in data)
+# Radio sessions by guild, the bot leaves channels that have been empty for RADIO_IDLE_TIMEOUT seconds
+voice_sessions = VoiceSessions(radio_hub, idle_timeout=int(os.getenv('RADIO_IDLE_TIMEOUT', 300)), logger=logger)
+metrics.gauge('voice_sessions', 'Guilds the bot is playing radio in.', collect=lambda: len(voice_sessions))
+metrics.gauge('radio_stations', 'Radio streams being decoded.', collect=lambda: len(radio_hub.stations()))
+metrics.gauge('radio_listeners', 'Voice connections listening to a radio stream.', collect=lambda: sum(radio_hub.stations().values()))
+metrics.counter('voice_reconnects_total', 'Radio streams restarted after they dropped.', collect=lambda: voice_sessions.reconnects)
 
-    if not has_subscription:
-        error_embed = discord.Embed(title='Error', description='❌ You do not have an active subscription.', color=discord.Color.red())
-        await interaction.response.send_message(embed=error_embed)
-        return
+@bot.event
+async def on_voice_state_update(member, before, after):
+    voice_sessions.voice_state_update(member, before, after)
 
+@tree.command(name='radio', description='Plays a radio station.')
+@premium_only()
+async def radio(interaction: discord.Interaction, station: str = 'http://radio.syncwi.de:8000/stream.aac'):
     # Get the user's voice channel
     voice_channel = interaction.user.voice.channel if interaction.user.voice else None
     if not voice_channel:
         no_channel_embed = discord.Embed(title='Error', description='❌ You need to join a voice channel first.', color=discord.Color.red())
-        bot.logger.error(f'{interaction.user} tried to play radio station {station} in {voice_channel.name} on server {interaction.guild.name} but was not in a voice channel')
+        bot.logger.error(f'{interaction.user} tried to play radio station {station} on server {interaction.guild.name} but was not in a voice channel')
         await interaction.response.send_message(embed=no_channel_embed)
         return
 
-    # Join the voice channel
-    vc = await voice_channel.connect()
+    # Joining a voice channel can take longer than Discord waits for a response
+    await interaction.response.defer()
 
-    # Start playing the radio stream using FFmpeg
+    # Join the voice channel and start playing, the session keeps running after this command returns
     try:
-        vc.play(
-            discord.FFmpegPCMAudio(station),  # The radio stream URL
-            after=lambda e: print(f'Error occurred: {e}')  # Handle errors
-        )
-        
+        await voice_sessions.play(voice_channel, station)
+
         bot.logger.info(f'{interaction.user} played radio station {station} in {voice_channel.name} on server {interaction.guild.name}')
         active_embed = discord.Embed(title='Success', description=f'✅ Playing {station} in {voice_channel.name}.', color=discord.Color.green())
-        await interaction.response.send_message(embed=active_embed)
-        
-        # Wait until the audio finishes playing or until the user disconnects
-        while vc.is_playing():
-            await asyncio.sleep(1)
-
-        # Disconnect the bot after the stream ends
-        await vc.disconnect()
+        await interaction.followup.send(embed=active_embed)
 
     except Exception as e:
         error_embed = discord.Embed(title='Error', description=f'❌ Failed to play the radio station: {str(e)}', color=discord.Color.red())
         bot.logger.error(f'Failed to play radio station {station} in {voice_channel.name} on server {interaction.guild.name}: {str(e)}')
-        await interaction.response.send_message(embed=error_embed)
+        await interaction.followup.send(embed=error_embed)
 
 # DISCONNECT COMMAND
 
 @tree.command(name='disconnect', description='Disconnects the bot from the voice channel.')
 async def disconnect(interaction: discord.Interaction):
-    # Get the bot's voice channel
-    voice_channel = bot.voice_clients[0] if bot.voice_clients else None
+    # Get the bot's voice channel in this server
+    voice_client = interaction.guild.voice_client
+    if voice_client is None:
+        error_embed = discord.Embed(title='Error', description='❌ I am not in a voice channel on this server.', color=discord.Color.red())
+        await interaction.response.send_message(embed=error_embed)
+        return
 
     # Disconnect the bot from the voice channel
     try:
-        await voice_channel.disconnect()
+        voice_channel = voice_client.channel
+        if not await voice_sessions.stop(interaction.guild.id):
+            await voice_client.disconnect()
         bot.logger.info(f'{interaction.user} disconnected from {voice_channel.name} in {interaction.guild.name}')
         disconnect_embed = discord.Embed(title='Success', description='✅ Disconnected from the voice channel.', color=discord.Color.green())
         await interaction.response.send_message(embed=disconnect_embed)
 
     except Exception as e:
         error_embed = discord.Embed(title='Error', description=f'❌ Failed to disconnect: {str(e)}', color=discord.Color.red())
-        bot.logger.error(f'Failed to disconnect from Voice Channel {voice_channel.name} in {interaction.guild.name}: {str(e)}')
+        bot.logger.error(f'Failed to disconnect from Voice Channel in {interaction.guild.name}: {str(e)}')
         await interaction.response.send_message(embed=error_embed)
 
 # AI COMMAND
 
+AI_MODEL = os.getenv('AI_MODEL', 'gpt-3.5-turbo')
+AI_MAX_IN_FLIGHT = int(os.getenv('AI_MAX_IN_FLIGHT', 8))
+
+# Completions running at once: one per user, AI_MAX_IN_FLIGHT in total and a short queue behind that.
+# Conversation summaries count as one more user, so only one of them runs at a time.
+ai_limiter = InFlightLimiter(per_user=1, total=AI_MAX_IN_FLIGHT, max_waiting=AI_MAX_IN_FLIGHT * 4)
+AI_SUMMARY_KEY = 'summaries'
+ai_client = None
+
+# Answers to repeated prompts, saved to disk every few minutes so a restart keeps them
+ai_cache = ResponseCache(
+    max_entries=int(os.getenv('AI_CACHE_SIZE', 1000)),
+    ttl=int(os.getenv('AI_CACHE_TTL', 86400)),
+    path=os.getenv('AI_CACHE_PATH', 'data/ai_cache.json') or None
+)
+ai_cache_settings = {}  # guild_id -> whether /ai answers in that guild are cached
+
+def get_ai_client():
+    # One client for every /ai call so connections are reused, created on first use
+    global ai_client
+    if ai_client is None:
+        import httpx
+        import openai
+        ai_client = openai.AsyncOpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            timeout=60,
+            max_retries=2,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=AI_MAX_IN_FLIGHT, max_keepalive_connections=AI_MAX_IN_FLIGHT)
+            )
+        )
+    return ai_client
+
+def ai_embed(text):
+    return {'embed': discord.Embed(title="AI Response", description=text, color=discord.Color.blue())}
+
+async def ai_cache_enabled(guild):
+    if guild is None:
+        return True
+    if guild.id not in ai_cache_settings:
+        result = await db.fetchone('SELECT cache_enabled FROM guild_ai_settings WHERE guild_id = %s', (guild.id,))
+        ai_cache_settings[guild.id] = bool(result[0]) if result else True
+    return ai_cache_settings[guild.id]
+
+# Recent turns of channels in conversation mode, older turns are summarized
+async def summarize_conversation(summary, turns, max_tokens):
+    slot = ai_limiter.acquire(AI_SUMMARY_KEY)
+    if slot is None:
+        # Another summary is running or the queue is full, these turns go with the next summary
+        return None
+    transcript = '\n'.join(f'{role}: {content}' for role, content in turns)
+    if summary:
+        transcript = f'Earlier summary: {summary}\n\n{transcript}'
+    async with slot:
+        await slot.wait()
+        response = await get_ai_client().chat.completions.create(
+            model=AI_MODEL,
+            messages=[
+                {"role": "system", "content": "Summarize this conversation in a few sentences. Keep names, facts and open questions."},
+                {"role": "user", "content": transcript}
+            ],
+            max_tokens=max_tokens
+        )
+    return response.choices[0].message.content
+
+ai_memory = ConversationMemory(
+    token_budget=int(os.getenv('AI_CONVERSATION_TOKENS', 2000)),
+    idle_timeout=int(os.getenv('AI_CONVERSATION_IDLE', 1800)),
+    max_conversations=5000,
+    summarize=summarize_conversation,
+    logger=logger
+)
+conversation_channels = {}  # channel_id -> whether conversation mode is on
+
+async def conversation_enabled(channel):
+    if channel.id not in conversation_channels:
+        result = await db.fetchone('SELECT 1 FROM ai_conversation_channels WHERE channel_id = %s', (channel.id,))
+        conversation_channels[channel.id] = result is not None
+    return conversation_channels[channel.id]
+
+@tasks.loop(minutes=5)
+async def save_ai_cache():
+    await ai_cache.save()
+
+@save_ai_cache.before_loop
+async def load_ai_cache():
+    count = await ai_cache.load()
+    bot.logger.info(f'Loaded {count} cached AI responses')
+
 @tree.command(name='ai', description='Generates an AI response.')
+@premium_only()
 async def ai(interaction: discord.Interaction, prompt: str):
-    application_id = bot.application_id  # Get the bot's application ID
-    user_id = interaction.user.id
+    slot = ai_limiter.acquire(interaction.user.id)
+    if slot is None:
+        busy_embed = discord.Embed(title='Error', description='⏳ Please wait for your current AI response to finish.', color=discord.Color.red())
+        await interaction.response.send_message(embed=busy_embed, ephemeral=True)
+        return
 
-    # Manually fetch entitlements using the bot's HTTP client
-    data = await bot.http.get_entitlements(application_id)
+    async with slot:
+        # Generate AI response using OpenAI
+        await interaction.response.defer()  # Defer response to allow processing time
+        reply = StreamingReply(interaction.followup, ai_embed, interval=1.0)
+        try:
+            try:
+                conversation = await conversation_enabled(interaction.channel)
+                use_cache = not conversation and await ai_cache_enabled(interaction.guild)
+            except Error as e:
+                bot.logger.error(f"Database error loading AI settings: {e}")
+                conversation = use_cache = False
+
+            # Answers in a conversation depend on what was said before, so they are never cached
+            cached = ai_cache.get(AI_MODEL, prompt) if use_cache else None
+            if cached is not None:
+                await reply.append(cached)
+                await reply.finish()
+                bot.logger.info(f'{interaction.user} got a cached AI response on server {interaction.guild.name}', extra=interaction_context(interaction))
+                return
 
-    if not data:
-        not_data_embed = discord.Embed(title='Error', description='❌ No entitlements found.', color=discord.Color.red())
-        await interaction.response.send_message(embed=not_data_embed)
-        return
+            messages = ai_memory.messages(interaction.channel.id, prompt) if conversation else [{"role": "user", "content": prompt}]
+            await slot.wait()
+            stream = await get_ai_client().chat.completions.create(
+                model=AI_MODEL,
+                messages=messages,
+                stream=True
+            )
+            # Tokens are shown as they arrive, the message is edited at most once a second.
+            # The stream is closed even when editing fails, otherwise it keeps one of the client's connections.
+            finish_reason = None
+            async with stream:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    if chunk.choices[0].delta.content:
+                        await reply.append(chunk.choices[0].delta.content)
+                    finish_reason = chunk.choices[0].finish_reason or finish_reason
+            await reply.finish()
+
+            if conversation and reply.text:
+                ai_memory.add(interaction.channel.id, prompt, reply.text)
+            # Only complete answers are cached, not ones cut off by the token limit
+            if use_cache and finish_reason == 'stop' and reply.text:
+                ai_cache.put(AI_MODEL, prompt, reply.text)
+
+            bot.logger.info(f'{interaction.user} generated AI response ({len(reply.text)} characters) on server {interaction.guild.name}', extra=interaction_context(interaction))
+
+        except Exception as e:
+            exception_embed = discord.Embed(title='Error', description=f"⚠️ Error generating response: {str(e)}", color=discord.Color.red())
+            bot.logger.error(f'Error generating AI response on server {interaction.guild.name} by {interaction.user.name}: {str(e)}')
+            await interaction.followup.send(embed=exception_embed)
+
+# AI CACHE COMMAND
+
+@tree.command(name='aicache', description='Turns caching of AI responses on or off for this server.')
+@app_commands.guild_only()
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.checks.has_permissions(manage_guild=True)
+async def aicache(interaction: discord.Interaction, enabled: bool = None):
+    if enabled is not None:
+        try:
+            await db.execute(
+                'INSERT INTO guild_ai_settings (guild_id, cache_enabled) VALUES (%s, %s) '
+                'ON DUPLICATE KEY UPDATE cache_enabled = VALUES(cache_enabled)',
+                (interaction.guild.id, enabled)
+            )
+        except Error as e:
+            bot.logger.error(f"Database error in aicache: {e}")
+            await interaction.response.send_message("Error saving the setting. Please try again later.")
+            return
+        ai_cache_settings[interaction.guild.id] = enabled
+        bot.logger.info(f'{interaction.user} turned AI response caching {"on" if enabled else "off"} in server {interaction.guild.name}')
+    else:
+        try:
+            enabled = await ai_cache_enabled(interaction.guild)
+        except Error as e:
+            bot.logger.error(f"Database error in aicache: {e}")
+            await interaction.response.send_message("Error loading the setting. Please try again later.")
+            return
 
-    # Check if user has an active entitlement
-    has_subscription = any(entitlement["user_id"] == str(user_id) and entitlement["sku_id"] == "1347585991975637132" for entitlement in data)
+    stats = ai_cache.stats()
+    embed = discord.Embed(
+        title="AI Response Cache",
+        description=(
+            f"Caching is **{'on' if enabled else 'off'}** for this server.\n"
+            f"{stats['entries']} cached responses, {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)"
+        ),
+        color=discord.Color.green() if enabled else discord.Color.red()
+    )
+    await interaction.response.send_message(embed=embed)
 
-    if not has_subscription:
-        error_embed = discord.Embed(title='Error', description='❌ You do not have an active subscription.', color=discord.Color.red())
-        await interaction.response.send_message(embed=error_embed)
-        return
+# AI CONVERSATION COMMAND
 
-    # Generate AI response using OpenAI
-    await interaction.response.defer()  # Defer response to allow processing time
+@tree.command(name='aiconversation', description='Lets /ai remember the conversation in this channel.')
+@app_commands.guild_only()
+@app_commands.default_permissions(manage_channels=True)
+@app_commands.checks.has_permissions(manage_channels=True)
+async def aiconversation(interaction: discord.Interaction, enabled: bool):
     try:
-        client = openai.OpenAI()  # Create OpenAI client
-        ai_response = client.chat.completions.create(
-            model="gpt-3.5-turbo",  # or "gpt-4"
-            messages=[{"role": "user", "content": prompt}]
-        )
+        if enabled:
+            await db.execute(
+                'INSERT IGNORE INTO ai_conversation_channels (channel_id, guild_id) VALUES (%s, %s)',
+                (interaction.channel.id, interaction.guild.id)
+            )
+        else:
+            await db.execute('DELETE FROM ai_conversation_channels WHERE channel_id = %s', (interaction.channel.id,))
+    except Error as e:
+        bot.logger.error(f"Database error in aiconversation: {e}")
+        await interaction.response.send_message("Error saving the setting. Please try again later.")
+        return
+    conversation_channels[interaction.channel.id] = enabled
+    if not enabled:
+        ai_memory.clear(interaction.channel.id)
 
-        response_text = ai_response.choices[0].message.content
+    bot.logger.info(f'{interaction.user} turned AI conversation mode {"on" if enabled else "off"} in {interaction.channel.name} on server {interaction.guild.name}')
+    description = '🧠 /ai now remembers the conversation in this channel.' if enabled else '/ai no longer remembers the conversation in this channel.'
+    embed = discord.Embed(title="AI Conversation", description=description, color=discord.Color.green() if enabled else discord.Color.red())
+    await interaction.response.send_message(embed=embed)
 
-        bot.logger.info(f'{interaction.user} generated AI response: {response_text} on server {interaction.guild.name}')
-        embed = discord.Embed(title="AI Response", description=response_text, color=discord.Color.blue())
-        await interaction.followup.send(embed=embed)
+# ECONOMY COMMANDS
 
-    except Exception as e:
-        exception_embed = discord.Embed(title='Error', description=f"⚠️ Error generating response: {str(e)}", color=discord.Color.red())
-        bot.logger.error(f'Error generating AI response on server {interaction.guild.name} by {interaction.user.name}: {str(e)}')
-        await interaction.followup.send(embed=exception_embed)
+# Top of the leaderboard kept in memory, updated by every command that changes points
+points_ranking = PointsRanking(size=10, capacity=50)
+user_names = NameCache(bot.get_user, bot.fetch_user, ttl=3600)
 
-# ECONOMY COMMANDS
+# Balances are changed in memory and written to the database in batches, see ledger.py
+ledger = Ledger(
+    db,
+    os.getenv("LEDGER_JOURNAL", "data/ledger.journal"),
+    flush_interval=float(os.getenv("LEDGER_FLUSH_INTERVAL", 1)),
+    on_change=points_ranking.update,
+    logger=logger
+)
 
 # DAYLY REWARDS COMMAND
 
+async def daily_cooldown_ends(user_id):
+    account = await ledger.account(user_id)
+    return (account.last_collected + timedelta(days=1)).timestamp() if account.last_collected else None
+
 @tree.command(name='daily', description='Collect your daily reward points')
+@cooldown('daily', 86400, load=daily_cooldown_ends, start=False, title="Daily Reward Not Ready",
+          message="You need to wait {hours}h {minutes}m before collecting again!")
 async def daily(interaction: discord.Interaction):
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
         now = datetime.now()
         base_points = 100
         premium_multiplier = 5
         
         # Check premium status
-        application_id = bot.application_id
-        data = await bot.http.get_entitlements(application_id)
-        is_premium = any(e["user_id"] == str(interaction.user.id) and e["sku_id"] == "1347585991975637132" for e in data)
+        premium = await is_premium(interaction.user)
         
         # Check existing user
-        cursor.execute('SELECT * FROM user_points WHERE user_id = %s', (interaction.user.id,))
-        user_data = cursor.fetchone()
+        account = await ledger.account(interaction.user.id)
         
-        if not user_data:
-            points_earned = base_points * (premium_multiplier if is_premium else 1)
-            cursor.execute(
-                'INSERT INTO user_points (user_id, points, streak, last_collected) VALUES (%s, %s, %s, %s)',
-                (interaction.user.id, points_earned, 1, now)
-            )
+        if not account.exists:
+            points_earned = base_points * (premium_multiplier if premium else 1)
             streak = 1
+            ledger.apply(account, points_earned, streak=streak, last_collected=now)
         else:
-            current_points = user_data[1]
-            streak = user_data[2]
-            last_collected = user_data[3]
+            streak = account.streak
+            last_collected = account.last_collected
             
-            time_since_last = now - last_collected
-            if time_since_last.total_seconds() < 86400:  # 86400 seconds = 24 hours
+            time_since_last = now - last_collected if last_collected else None
+            if time_since_last is not None and time_since_last.total_seconds() < 86400:  # 86400 seconds = 24 hours
                 time_remaining = timedelta(days=1) - time_since_last
                 hours = int(time_remaining.total_seconds() // 3600)
                 minutes = int((time_remaining.total_seconds() % 3600) // 60)
@@ -699,14 +1335,10 @@ async def daily(interaction: discord.Interaction):
                 7: 200
             }.get(next((k for k in [365, 180, 90, 30, 14, 7] if streak >= k), 0), 0)
             
-            points_earned = (base_points + bonus) * (premium_multiplier if is_premium else 1)
+            points_earned = (base_points + bonus) * (premium_multiplier if premium else 1)
             
-            cursor.execute(
-                'UPDATE user_points SET points = points + %s, streak = %s, last_collected = %s WHERE user_id = %s',
-                (points_earned, streak, now, interaction.user.id)
-            )
-        
-        conn.commit()
+            ledger.apply(account, points_earned, streak=streak, last_collected=now)
+        cooldowns.start('daily', interaction.user.id, 86400)
         
         embed = discord.Embed(
             title="Daily Reward Collected!",
@@ -718,47 +1350,73 @@ async def daily(interaction: discord.Interaction):
     except Error as e:
         bot.logger.error(f"Database error: {e}")
         await interaction.response.send_message("Error processing daily reward. Please try again later.")
-        
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
 
 # LEADERBOARD COMMAND
 
+async def load_points_ranking():
+    if not points_ranking.loaded:
+        # Write pending balance changes first so the database is up to date
+        await ledger.flush()
+        rows = await db.fetchall('SELECT user_id, points FROM user_points ORDER BY points DESC LIMIT %s', (points_ranking.capacity,))
+        points_ranking.load(rows)
+
 @tree.command(name='leaderboard', description='Shows point leaderboard')
 async def leaderboard(interaction: discord.Interaction):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id, points FROM user_points ORDER BY points DESC LIMIT 10')
-    leaders = cursor.fetchall()
+    try:
+        await load_points_ranking()
+    except Error as e:
+        bot.logger.error(f"Database error in leaderboard: {e}")
+        await interaction.response.send_message("Error fetching the leaderboard. Please try again later.")
+        return
+
+    leaders = points_ranking.top()
+    names = await user_names.resolve([user_id for user_id, _ in leaders])
     
     embed = discord.Embed(title="🏆 Points Leaderboard", color=discord.Color.gold())
     for idx, (user_id, points) in enumerate(leaders, 1):
-        user = await bot.fetch_user(user_id)
-        embed.add_field(name=f"{idx}. {user.name}", value=f"{points} points", inline=False)
+        embed.add_field(name=f"{idx}. {names[user_id]}", value=f"{points} points", inline=False)
     
     await interaction.response.send_message(embed=embed)
-    cursor.close()
-    conn.close()
+
+# RANK COMMAND
+
+@tree.command(name='rank', description='Shows your position on the leaderboard')
+async def rank(interaction: discord.Interaction):
+    try:
+        await load_points_ranking()
+        position = points_ranking.position(interaction.user.id)
+        points = points_ranking.points(interaction.user.id)
+        if position is None:
+            account = await ledger.account(interaction.user.id)
+            if account.exists:
+                # Outside the cached top, count the users above (uses the index on points)
+                await ledger.flush()
+                points = account.points
+                result = await db.fetchone('SELECT COUNT(*) FROM user_points WHERE points > %s', (points,))
+                position = result[0] + 1
+
+    except Error as e:
+        bot.logger.error(f"Database error in rank: {e}")
+        await interaction.response.send_message("Error fetching your rank. Please try again later.")
+        return
+
+    if position is None:
+        embed = discord.Embed(title="Rank", description="You have no points yet.", color=discord.Color.red())
+    else:
+        embed = discord.Embed(title="Rank", description=f"You are **#{position}** with {points} points.", color=discord.Color.gold())
+    await interaction.response.send_message(embed=embed)
 
 # BALANCE COMMAND
 
 @tree.command(name='balance', description='Check your current balance')
 async def balance(interaction: discord.Interaction):
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('SELECT points FROM user_points WHERE user_id = %s', (interaction.user.id,))
-        result = cursor.fetchone()
+        account = await ledger.account(interaction.user.id)
 
-        if result:
-            points = result[0]
+        if account.exists:
             embed = discord.Embed(
                 title="Balance",
-                description=f"You have {points} points.",
+                description=f"You have {account.points} points.",
                 color=discord.Color.green()
             )
             await interaction.response.send_message(embed=embed)
@@ -774,20 +1432,15 @@ async def balance(interaction: discord.Interaction):
         bot.logger.error(f"Database error: {e}")
         await interaction.response.send_message("Error fetching balance. Please try again later.")
 
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
-
 # TRANSFER COMMAND
 
 @tree.command(name='transfer', description='Transfer points to another user')
 async def transfer(interaction: discord.Interaction, recipient: discord.User, amount: int):
-    conn = None
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    if amount <= 0:
+        await interaction.response.send_message("Transfer amount must be positive!")
+        return
 
+    try:
         # Calculate fee (changes daily at 12PM UTC+1)
         now = datetime.now()
         seed = int(now.replace(hour=12, minute=0, second=0, microsecond=0).timestamp())
@@ -796,39 +1449,16 @@ async def transfer(interaction: discord.Interaction, recipient: discord.User, am
         fee_amount = int(amount * (fee_percentage / 100))
         total_cost = amount + fee_amount
 
-        # Get sender's points
-        cursor.execute('SELECT points FROM user_points WHERE user_id = %s', (interaction.user.id,))
-        sender_data = cursor.fetchone()
+        fee_user_id = 1011702976555004007
+        sender_account = await ledger.account(interaction.user.id)
+        recipient_account = await ledger.account(recipient.id)
+        fee_account = await ledger.account(fee_user_id)
 
-        if not sender_data or sender_data[0] < total_cost:
+        # Deduct amount + fee from the sender, the recipient gets the full amount and the fee goes to the fee account
+        if not ledger.spend(sender_account, total_cost, [(recipient_account, amount), (fee_account, fee_amount)]):
             await interaction.response.send_message(f"You need {total_cost} points for this transfer (including {fee_percentage}% fee)!")
             return
 
-        # Update sender's points (deduct amount + fee)
-        cursor.execute('UPDATE user_points SET points = points - %s WHERE user_id = %s', 
-                      (total_cost, interaction.user.id))
-
-        # Update or create recipient's points (gets full amount)
-        cursor.execute('SELECT points FROM user_points WHERE user_id = %s', (recipient.id,))
-        if cursor.fetchone():
-            cursor.execute('UPDATE user_points SET points = points + %s WHERE user_id = %s',
-                         (amount, recipient.id))
-        else:
-            cursor.execute('INSERT INTO user_points (user_id, points, streak, last_collected) VALUES (%s, %s, %s, %s)',
-                         (recipient.id, amount, 0, now))
-
-        # Add fee to specified user
-        fee_user_id = 1011702976555004007
-        cursor.execute('SELECT points FROM user_points WHERE user_id = %s', (fee_user_id,))
-        if cursor.fetchone():
-            cursor.execute('UPDATE user_points SET points = points + %s WHERE user_id = %s',
-                         (fee_amount, fee_user_id))
-        else:
-            cursor.execute('INSERT INTO user_points (user_id, points, streak, last_collected) VALUES (%s, %s, %s, %s)',
-                         (fee_user_id, fee_amount, 0, now))
-
-        conn.commit()
-
         # Send confirmation messages
         sender_embed = discord.Embed(
             title="Transfer Successful",
@@ -859,45 +1489,26 @@ async def transfer(interaction: discord.Interaction, recipient: discord.User, am
         )
         await interaction.response.send_message(embed=error_embed)
 
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
-
 # GAMBLE COMMAND
 
 @tree.command(name='gamble', description='Gamble your points')
 async def gamble(interaction: discord.Interaction, bet_amount: int):
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check user's current balance
-        cursor.execute('SELECT points FROM user_points WHERE user_id = %s', (interaction.user.id,))
-        result = cursor.fetchone()
-        current_balance = result[0] if result else 0
-        
         if bet_amount <= 0:
             await interaction.response.send_message("Bet amount must be positive!")
             return
-            
-        if bet_amount > current_balance:
-            await interaction.response.send_message(f"You don't have enough points! Your balance: {current_balance}")
-            return
+
+        account = await ledger.account(interaction.user.id)
         
         # Generate random multiplier between 0.0 and 2.0
         multiplier = round(random.uniform(0, 2), 1)
         winnings = int(bet_amount * multiplier)
         
-        # Update points in database
-        new_balance = current_balance - bet_amount + winnings
-        if result:
-            cursor.execute('UPDATE user_points SET points = %s WHERE user_id = %s', 
-                         (new_balance, interaction.user.id))
-        else:
-            cursor.execute('INSERT INTO user_points (user_id, points, streak, last_collected) VALUES (%s, %s, %s, %s)',
-                         (interaction.user.id, new_balance, 0, datetime.utcnow()))
+        # Take the bet and pay out the winnings in one step, only if the user can afford the bet
+        if not ledger.spend(account, bet_amount, [(account, winnings)]):
+            await interaction.response.send_message(f"You don't have enough points! Your balance: {account.points}")
+            return
+        new_balance = account.points
         
         # Create result message
         if multiplier > 1:
@@ -916,51 +1527,47 @@ async def gamble(interaction: discord.Interaction, bet_amount: int):
             color=color
         )
         
-        conn.commit()
         bot.logger.info(f'{interaction.user} gambled {bet_amount} points with {multiplier}x multiplier in {interaction.guild.name}')
         await interaction.response.send_message(embed=embed)
         
     except Error as e:
         bot.logger.error(f"Database error in gamble: {e}")
         await interaction.response.send_message("Error processing your gamble. Please try again.")
-        
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
 
 # WORK COMMAND
 
+# Questions for /work, generated ahead of time and refilled in the background
+work_questions = QuestionPool(size=300, refill_below=100)
+
+async def work_cooldown_ends(user_id):
+    account = await ledger.account(user_id)
+    return (account.last_worked + timedelta(hours=24)).timestamp() if account.last_worked else None
+
 @tree.command(name='work', description='Work for points and solve a math question.')
+@cooldown('work', 86400, load=work_cooldown_ends, start=False, title="Work",
+          message="You've already worked today. Come back tomorrow!")
 async def work(interaction: discord.Interaction):
-    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
         # Check if user exists and their last work time
-        cursor.execute('SELECT last_worked FROM user_points WHERE user_id = %s', (interaction.user.id,))
-        result = cursor.fetchone()
+        account = await ledger.account(interaction.user.id)
 
         now = datetime.now()
 
         # If user exists and has worked before
-        if result and result[0]:
-            time_since_last = now - result[0]
+        if account.last_worked:
+            time_since_last = now - account.last_worked
             if time_since_last < timedelta(hours=24):
                 await interaction.response.send_message("You've already worked today. Come back tomorrow!")
                 return
 
-        # Generate a hard math question
-        x = sp.symbols('x')
-        equation = sp.Eq(7 * x - 30, 70)  # Example equation: 7x - 30 = 70
-        solution = sp.solve(equation, x)[0]
+        # The cooldown starts with the question, so a second /work can't get another one while this one is open
+        cooldowns.start('work', interaction.user.id, 86400)
 
-        # Create the question string
-        question_str = f"Solve the equation: 7x - 30 = 70. What is x?"
+        # Take a pre-generated math question
+        question = work_questions.take()
 
         # Ask the user for their answer
-        await interaction.response.send_message(question_str)
+        await interaction.response.send_message(question.text)
 
         def check(m):
             return m.author == interaction.user and m.channel == interaction.channel
@@ -968,23 +1575,14 @@ async def work(interaction: discord.Interaction):
         try:
             # Wait for the user's response
             msg = await bot.wait_for('message', check=check, timeout=30.0)
-            user_answer = msg.content
-
-            # Evaluate the user's answer and the solution
-            user_answer_eval = sp.sympify(user_answer)  # Convert user answer to a sympy expression
-            if user_answer_eval == solution:
-                # Generate random points between 10 and 50
-                points = random.randint(10, 50)
 
-                # Insert or update user's points and last_worked time
-                if result:
-                    cursor.execute('UPDATE user_points SET points = points + %s, last_worked = %s WHERE user_id = %s',
-                                   (points, now, interaction.user.id))
-                else:
-                    cursor.execute('INSERT INTO user_points (user_id, points, streak, last_worked) VALUES (%s, %s, %s, %s)',
-                                   (interaction.user.id, points, 0, now))
+            # Only a plain integer (or "x = 12") counts as an answer
+            if parse_answer(msg.content) == question.answer:
+                # Harder questions pay more
+                points = work_questions.reward(question)
 
-                conn.commit()
+                # Add the user's points and last_worked time
+                ledger.apply(account, points, last_worked=now)
 
                 embed = discord.Embed(title="Work Complete!",
                                       description=f"You worked and earned {points} points!",
@@ -993,14 +1591,12 @@ async def work(interaction: discord.Interaction):
                 await interaction.channel.send(embed=embed)
             else:
                 # Update last_worked time even if the answer is incorrect
-                cursor.execute('UPDATE user_points SET last_worked = %s WHERE user_id = %s', (now, interaction.user.id))
-                conn.commit()
-                await interaction.channel.send(f"❌ Incorrect! The correct answer is {solution}. You did not earn any points.")
+                ledger.apply(account, last_worked=now)
+                await interaction.channel.send(f"❌ Incorrect! The correct answer is {question.answer}. You did not earn any points.")
 
         except asyncio.TimeoutError:
             # Update last_worked time if the user takes too long
-            cursor.execute('UPDATE user_points SET last_worked = %s WHERE user_id = %s', (now, interaction.user.id))
-            conn.commit()
+            ledger.apply(account, last_worked=now)
             await interaction.channel.send("⏰ You took too long to respond! You cannot work again today.")
 
     except Exception as e:
@@ -1008,11 +1604,6 @@ async def work(interaction: discord.Interaction):
         if not interaction.response.is_done():  # Check if the interaction has already been responded to
             await interaction.response.send_message("Error processing your work. Please try again.")
 
-    finally:
-        if conn and conn.is_connected():
-            cursor.close()
-            conn.close()
-
 # ADVERTISING COMMANDS
 
 # INVITE COMMAND
@@ -1038,5 +1629,8 @@ async def legal(interaction: discord.Interaction):
     embed = discord.Embed(title='Nexus Legal Info', description=f'Here are the Legal Links for the bot {bot.user.name}:\n\nTerms Of Service (ToS): [Click Here](<https://syncwi.de/terms-of-service.html>)\nPrivacy Policy: [Click Here](<https://syncwi.de/privacy-policy.html>)\nContact: [Click Here](<https://syncwi.de/contact.html>)\n\n**Next Info only Relevant for Developers!**\n\nThe {bot.user.name} Bot is Licensed under the [MIT License](<https://opensource.org/license/mit>) which you can view by [Clicking Here](<https://github.com/SyncWide-Solutions/Nexus/blob/main/LICENSE>)', color=discord.Color.green())
     await interaction.response.send_message(embed=embed)
 
+# Time every @bot.event handler above, this has to stay after the last one
+instrument_events(bot, event_seconds, event_errors)
+
 if __name__ == "__main__":
     bot.run(TOKEN)
\ No newline at end of file
@@ -0,0 +1,233 @@
+import asyncio
+import functools
+import time
+from bisect import bisect_left
+
+from aiohttp import web
+
+# PROMETHEUS METRICS
+#
+# Counters, gauges and histograms kept in memory and served in Prometheus'
+# text format on a local HTTP endpoint. Recording a value is a dict lookup
+# and an addition on the event loop; gauges that mirror state kept elsewhere
+# (voice sessions, the database pool) are read with a collect function when
+# the endpoint is scraped instead of being updated all the time.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        # collect() -> value, or {label values: value} for labelled metrics, called on every scrape
+        self.collect = collect
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f'{self.name} takes labels {self.label_names}, got {values}')
+            child = self._children[values] = self._child()
+        return child
+
+    def _child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        if self.collect is None:
+            return [(values, child.value) for values, child in self._children.items()]
+        collected = self.collect()
+        if isinstance(collected, dict):
+            return [(values if isinstance(values, tuple) else (values,), value) for values, value in collected.items()]
+        return [((), collected)]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for values, value in self._samples():
+            lines.append(f'{self.name}{_labels(self.label_names, values)} {_number(value)}')
+        return lines
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def _child(self):
+        return _Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class _Buckets:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, values, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, values)} {_number(child.sum)}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, values)} {child.count}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=(), collect=None):
+        return self._add(Counter(self.prefix + name, help, labels, collect))
+
+    def gauge(self, name, help, labels=(), collect=None):
+        return self._add(Gauge(self.prefix + name, help, labels, collect))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # One broken collect function shouldn't take the whole endpoint down
+                lines.append(f'# {metric.name} failed: {_escape(e)}')
+        return '\n'.join(lines) + '\n'
+
+
+async def serve_metrics(registry, host='127.0.0.1', port=9464):
+    # Serves GET /metrics until the returned runner is cleaned up
+    async def handle(request):
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8', headers={'X-Content-Type-Options': 'nosniff'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+# INSTRUMENTATION
+
+
+def instrument_events(bot, duration, errors):
+    # Wraps every event registered with @bot.event, call it after the last one is defined
+    for name, handler in list(vars(bot).items()):
+        if name.startswith('on_') and asyncio.iscoroutinefunction(handler):
+            setattr(bot, name, _timed_event(name[3:], handler, duration, errors))
+
+
+def _timed_event(event, handler, duration, errors):
+    @functools.wraps(handler)
+    async def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        except Exception:
+            errors.labels(event).inc()
+            raise
+        finally:
+            duration.labels(event).observe(time.perf_counter() - started)
+    return timed
+
+
+def instrument_http(http, duration, errors):
+    # Times every Discord REST request by method and route template, e.g. POST /channels/{channel_id}/messages
+    request = http.request
+
+    @functools.wraps(request)
+    async def timed(route, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await request(route, **kwargs)
+        except Exception as e:
+            errors.labels(route.method, route.path, str(getattr(e, 'status', type(e).__name__))).inc()
+            raise
+        finally:
+            duration.labels(route.method, route.path).observe(time.perf_counter() - started)
+
+    http.request = timed
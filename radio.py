@@ -0,0 +1,225 @@
+import asyncio
+import re
+import shlex
+import subprocess
+import threading
+import time
+from collections import OrderedDict, deque
+
+import discord
+from discord.oggparse import OggStream
+
+# RADIO HUB
+#
+# One FFmpeg process per station, no matter how many guilds listen to it. The
+# process pulls the stream, decodes it and encodes Opus once, and a reader
+# thread hands every Opus packet to all listeners of that station. Voice
+# clients play a StationListener, which is already Opus, so discord.py sends
+# the packets as they are instead of encoding audio per connection.
+#
+# Stations that already send Opus (Ogg or WebM) are not transcoded at all: the
+# codec of each station is probed once, cached, and Opus streams are only
+# remuxed into Ogg pages.
+
+OPUS_SILENCE = b'\xf8\xff\xfe'
+RECONNECT_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+AUDIO_STREAM = re.compile(r'Stream #\d+:\d+.*?: Audio: (\w+)')
+PASSTHROUGH_CODECS = ('opus',)
+
+
+def probe_codec(url, executable='ffmpeg', timeout=15):
+    # ffmpeg without an output file prints the input's streams and exits
+    args = [executable, '-hide_banner']
+    if url.startswith(('http://', 'https://')):
+        args.extend(shlex.split(RECONNECT_OPTIONS))
+    args.extend(('-i', url))
+    result = subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout)
+    match = AUDIO_STREAM.search(result.stderr.decode('utf-8', 'replace'))
+    return match.group(1) if match else None
+
+
+def ffmpeg_args(url, codec='libopus', bitrate=128, before_options=None, executable='ffmpeg'):
+    args = [executable]
+    if before_options is None and url.startswith(('http://', 'https://')):
+        before_options = RECONNECT_OPTIONS
+    if before_options:
+        args.extend(shlex.split(before_options))
+    args.extend(('-i', url,
+                 '-map_metadata', '-1',
+                 '-vn',
+                 '-f', 'opus',
+                 '-c:a', codec,
+                 '-ar', '48000',
+                 '-ac', '2',
+                 '-b:a', f'{bitrate}k',
+                 # One Ogg page per packet, so packets reach listeners as they are encoded
+                 '-page_duration', '20000',
+                 '-loglevel', 'warning',
+                 'pipe:1'))
+    return args
+
+
+class StationListener(discord.AudioSource):
+    def __init__(self, station, max_buffer=50):
+        self.station = station
+        # ~1 second of audio, a listener that falls behind skips ahead instead of lagging
+        self._packets = deque(maxlen=max_buffer)
+        self._ended = False
+        self._closed = False
+
+    def push(self, packet):
+        self._packets.append(packet)
+
+    def end(self):
+        self._ended = True
+
+    def read(self):
+        # Called every 20ms by the voice client's player thread
+        try:
+            return self._packets.popleft()
+        except IndexError:
+            # b'' stops the player, anything else keeps the connection going
+            return b'' if self._ended else OPUS_SILENCE
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        if not self._closed:
+            self._closed = True
+            self.station.unsubscribe(self)
+
+
+class Station:
+    def __init__(self, hub, url, args):
+        self.hub = hub
+        self.url = url
+        self.args = args
+        self.packets = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._process = None
+        self._thread = None
+
+    def start(self):
+        self._process = subprocess.Popen(self.args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._thread = threading.Thread(target=self._pump, name=f'radio:{self.url}', daemon=True)
+        self._thread.start()
+
+    @property
+    def listeners(self):
+        return len(self._listeners)
+
+    def subscribe(self, max_buffer=50):
+        listener = StationListener(self, max_buffer)
+        with self._lock:
+            self._listeners.append(listener)
+            # The reader thread replaces the list instead of changing it, so it can iterate without the lock
+            self._listeners = list(self._listeners)
+        return listener
+
+    def unsubscribe(self, listener):
+        # Under the hub's lock, so listen() can't join a station that is about to stop
+        with self.hub._lock:
+            with self._lock:
+                self._listeners = [other for other in self._listeners if other is not listener]
+                empty = not self._listeners
+            if empty and self.hub._stations.get(self.url) is self:
+                del self.hub._stations[self.url]
+        if empty:
+            self.stop()
+
+    def _pump(self):
+        try:
+            for packet in OggStream(self._process.stdout).iter_packets():
+                self.packets += 1
+                for listener in self._listeners:
+                    listener.push(packet)
+        except Exception:
+            # A broken pipe or a corrupt page ends the stream the same way as EOF
+            pass
+        finally:
+            self.hub._stopped(self)
+            for listener in self._listeners:
+                listener.end()
+            self.stop()
+
+    def stop(self):
+        process = self._process
+        if process is not None and process.poll() is None:
+            process.kill()
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                pass
+
+
+class RadioHub:
+    def __init__(self, bitrate=128, executable='ffmpeg', passthrough=True, probe_ttl=86400, max_codecs=1000):
+        self.bitrate = bitrate
+        self.executable = executable
+        self.passthrough = passthrough
+        self.probe_ttl = probe_ttl
+        self.max_codecs = max_codecs
+        self._stations = {}  # url -> running Station
+        self._codecs = OrderedDict()  # url -> (probed_at, codec name or None), least recently used first
+        self._probes = {}  # url -> probe task in flight
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._stations)
+
+    def stations(self):
+        return {url: station.listeners for url, station in self._stations.items()}
+
+    # CODEC PROBING
+
+    def codec(self, url):
+        cached = self._codecs.get(url)
+        return cached[1] if cached is not None else None
+
+    async def probe(self, url):
+        # Probes the station's codec once per probe_ttl, concurrent callers share one probe
+        cached = self._codecs.get(url)
+        if cached is not None and time.monotonic() - cached[0] < self.probe_ttl:
+            self._codecs.move_to_end(url)
+            return cached[1]
+        task = self._probes.get(url)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(probe_codec, url, self.executable))
+            self._probes[url] = task
+            task.add_done_callback(lambda _: self._probes.pop(url, None))
+        try:
+            codec = await asyncio.shield(task)
+        except (OSError, subprocess.SubprocessError):
+            # Unreachable right now, transcode this time and probe again next time
+            return None
+        self._codecs[url] = (time.monotonic(), codec)
+        self._codecs.move_to_end(url)
+        while len(self._codecs) > self.max_codecs:
+            self._codecs.popitem(last=False)
+        return codec
+
+    def output_codec(self, url):
+        return 'copy' if self.passthrough and self.codec(url) in PASSTHROUGH_CODECS else 'libopus'
+
+    def listen(self, url, before_options=None):
+        # Returns an AudioSource for vc.play(), starting the station if nobody listens to it yet
+        with self._lock:
+            station = self._stations.get(url)
+            if station is None:
+                args = ffmpeg_args(url, codec=self.output_codec(url), bitrate=self.bitrate, before_options=before_options, executable=self.executable)
+                station = Station(self, url, args)
+                station.start()
+                self._stations[url] = station
+            return station.subscribe()
+
+    def _stopped(self, station):
+        with self._lock:
+            if self._stations.get(station.url) is station:
+                del self._stations[station.url]
+
+    def close(self):
+        for station in list(self._stations.values()):
+            self._stopped(station)
+            station.stop()
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+# POINTS RANKING
+#
+# Materialized top of the points table. It is loaded from the database once and
+# then kept up to date by the economy commands, so /leaderboard doesn't need to
+# query anything. A few more users than are shown are tracked so that someone
+# dropping out of the top doesn't force a reload right away.
+#
+# Invariant: every user that isn't tracked has at most `floor` points, and every
+# tracked user has at least that many.
+
+
+class PointsRanking:
+    def __init__(self, size=10, capacity=50):
+        self.size = size
+        self.capacity = capacity
+        self.loaded = False
+        self._points = {}  # user_id -> points, tracked users only
+        self._floor = 0
+        self._complete = False  # True when every row in the table is tracked
+
+    def load(self, rows):
+        # rows: (user_id, points) ordered by points descending, at most `capacity` of them
+        self._points = {user_id: points for user_id, points in rows}
+        self._complete = len(rows) < self.capacity
+        self._floor = min(self._points.values()) if self._points and not self._complete else 0
+        self.loaded = True
+
+    def invalidate(self):
+        self.loaded = False
+
+    def update(self, user_id, points):
+        if not self.loaded:
+            return
+        tracked = self._points
+
+        if user_id in tracked:
+            if self._complete or points >= self._floor:
+                tracked[user_id] = points
+                return
+            # An untracked user may rank above this one now
+            del tracked[user_id]
+            if len(tracked) < self.size:
+                self.loaded = False
+            return
+
+        if not self._complete and points <= self._floor:
+            return
+        tracked[user_id] = points
+        if len(tracked) > self.capacity:
+            evicted_points = tracked.pop(min(tracked, key=tracked.get))
+            self._floor = evicted_points if self._complete else max(self._floor, evicted_points)
+            self._complete = False
+
+    def _ordered(self):
+        return sorted(self._points.items(), key=lambda item: item[1], reverse=True)
+
+    def top(self):
+        return self._ordered()[:self.size]
+
+    def points(self, user_id):
+        return self._points.get(user_id)
+
+    def position(self, user_id):
+        # 1-based rank of a tracked user, None if the user is outside the tracked top
+        if user_id not in self._points:
+            return None
+        points = self._points[user_id]
+        return 1 + sum(1 for other in self._points.values() if other > points)
+
+
+# USER NAME CACHE
+#
+# Resolves user ids to names: the client's user cache first, then names we
+# fetched earlier, and only then the API. Misses are fetched concurrently.
+
+
+class NameCache:
+    def __init__(self, get_user, fetch_user, ttl=3600, max_size=10000):
+        self._get_user = get_user
+        self._fetch_user = fetch_user
+        self.ttl = ttl
+        self.max_size = max_size
+        self._names = OrderedDict()  # user_id -> (name, expires_at)
+
+    def _remember(self, user_id, name):
+        self._names[user_id] = (name, time.monotonic() + self.ttl)
+        self._names.move_to_end(user_id)
+        while len(self._names) > self.max_size:
+            self._names.popitem(last=False)
+
+    async def resolve(self, user_ids, fallback='Unknown User'):
+        names = {}
+        missing = []
+        now = time.monotonic()
+        for user_id in user_ids:
+            user = self._get_user(user_id)
+            if user is not None:
+                names[user_id] = user.name
+                continue
+            cached = self._names.get(user_id)
+            if cached is not None and cached[1] > now:
+                names[user_id] = cached[0]
+                continue
+            missing.append(user_id)
+
+        if missing:
+            results = await asyncio.gather(*(self._fetch_user(user_id) for user_id in missing), return_exceptions=True)
+            for user_id, user in zip(missing, results):
+                if isinstance(user, Exception):
+                    names[user_id] = fallback
+                else:
+                    names[user_id] = user.name
+                    self._remember(user_id, user.name)
+        return names
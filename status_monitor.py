@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+# MONITOR STATUS SERVICE
+#
+# Keeps an in-memory snapshot of the Uptime Kuma monitors for /status. The
+# Uptime Kuma client is blocking, so login and refreshes run in a worker thread
+# from a background task. The login only happens on the first refresh, so the
+# bot starts fine while Uptime Kuma is down.
+
+
+class MonitorStatus:
+    def __init__(self, url, username, password, refresh_interval=60, logger=None):
+        self.url = url
+        self.username = username
+        self.password = password
+        self.refresh_interval = refresh_interval
+        self.logger = logger
+
+        self.fields = []  # pre-rendered (name, value) pairs for the embed
+        self.updated_at = None  # time.time() of the last successful refresh
+        self.last_error = None
+
+        self._api = None
+        self._monitors = None
+        self._task = None
+
+    @property
+    def age(self):
+        return None if self.updated_at is None else time.time() - self.updated_at
+
+    def _fetch(self):
+        if self._api is None:
+            from uptime_kuma_api import UptimeKumaApi
+
+            api = UptimeKumaApi(self.url)
+            api.login(self.username, self.password)
+            self._api = api
+        return [(monitor['name'], bool(monitor['active'])) for monitor in self._api.get_monitors()]
+
+    def _reset(self):
+        api, self._api = self._api, None
+        if api is not None:
+            try:
+                api.disconnect()
+            except Exception:
+                pass
+
+    async def refresh(self):
+        try:
+            monitors = await asyncio.to_thread(self._fetch)
+        except Exception as e:
+            self.last_error = str(e)
+            if self.logger:
+                self.logger.error(f"Error fetching server statuses: {e}")
+            # Log in again on the next refresh
+            await asyncio.to_thread(self._reset)
+            return False
+
+        self.last_error = None
+        self.updated_at = time.time()
+        if monitors != self._monitors:
+            # Only re-render the embed fields when something actually changed
+            self._monitors = monitors
+            self.fields = [(name, f"Status: {'Online' if active else 'Offline'}") for name, active in monitors]
+            if self.logger:
+                self.logger.info(f"Server statuses changed, {len(monitors)} monitors")
+        return True
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        self._reset()
@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+# STICKY MESSAGES
+#
+# One registry for every sticky message, keyed by channel, and a single
+# dispatcher that on_message calls. A busy channel reposts its sticky message
+# at most once per `interval`: the first message after a quiet period reposts
+# right away, anything after that is folded into one delayed repost.
+
+
+class Sticky:
+    __slots__ = ('channel', 'content', 'author_id', 'message', 'last_posted', 'pending')
+
+    def __init__(self, channel, content, author_id, message):
+        self.channel = channel
+        self.content = content
+        self.author_id = author_id
+        self.message = message
+        self.last_posted = time.monotonic()
+        self.pending = None  # scheduled repost task
+
+
+class StickyRegistry:
+    def __init__(self, interval=10.0, max_channels=5000, logger=None):
+        self.interval = interval
+        self.max_channels = max_channels
+        self.logger = logger
+        self._stickies = {}  # channel_id -> Sticky
+
+    def __len__(self):
+        return len(self._stickies)
+
+    def __contains__(self, channel_id):
+        return channel_id in self._stickies
+
+    def get(self, channel_id):
+        return self._stickies.get(channel_id)
+
+    def is_full(self, channel_id):
+        return channel_id not in self._stickies and len(self._stickies) >= self.max_channels
+
+    async def stick(self, channel, content, author_id):
+        # Replaces the sticky message of the channel if it already has one
+        old = self._stickies.pop(channel.id, None)
+        if old is not None:
+            await self._cancel_and_delete(old)
+        message = await channel.send(content)
+        self._stickies[channel.id] = Sticky(channel, content, author_id, message)
+
+    async def unstick(self, channel_id):
+        sticky = self._stickies.pop(channel_id, None)
+        if sticky is None:
+            return False
+        await self._cancel_and_delete(sticky)
+        return True
+
+    async def _cancel_and_delete(self, sticky):
+        if sticky.pending is not None:
+            sticky.pending.cancel()
+        await self._delete(sticky.message)
+
+    async def _delete(self, message):
+        try:
+            await message.delete()
+        except Exception as e:
+            # Already deleted by someone else, or we lost access to the channel
+            if self.logger:
+                self.logger.debug(f'Could not delete sticky message {message.id}: {e}')
+
+    def dispatch(self, message):
+        sticky = self._stickies.get(message.channel.id)
+        if sticky is None or sticky.pending is not None or message.id == sticky.message.id:
+            return None
+        delay = sticky.last_posted + self.interval - time.monotonic()
+        sticky.pending = asyncio.ensure_future(self._repost(sticky, max(0.0, delay)))
+        return sticky.pending
+
+    async def _repost(self, sticky, delay):
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+            old = sticky.message
+            sticky.message = await sticky.channel.send(sticky.content)
+            sticky.last_posted = time.monotonic()
+            await self._delete(old)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f'Failed to repost sticky message in channel {sticky.channel.id}: {e}')
+            # The channel is gone or we lost access to it, stop tracking it
+            if getattr(e, 'status', None) in (403, 404) and self._stickies.get(sticky.channel.id) is sticky:
+                del self._stickies[sticky.channel.id]
+        finally:
+            sticky.pending = None
@@ -0,0 +1,176 @@
+import asyncio
+import time
+
+# VOICE SESSIONS
+#
+# One radio session per guild. Nothing waits on a session while it plays: the
+# player's after callback reports a stream that stopped, voice state events
+# report members leaving or the bot being disconnected, and a single reaper
+# task disconnects sessions whose channel has been empty for `idle_timeout`
+# seconds.
+
+
+class VoiceSession:
+    __slots__ = ('guild_id', 'channel', 'voice_client', 'station', 'started', 'failures', 'empty_since', 'retry', 'stopping')
+
+    def __init__(self, guild_id, channel, voice_client, station):
+        self.guild_id = guild_id
+        self.channel = channel
+        self.voice_client = voice_client
+        self.station = station
+        self.started = time.monotonic()
+        self.failures = 0
+        self.empty_since = None
+        self.retry = None  # scheduled reconnect
+        self.stopping = False
+
+
+def listeners(channel):
+    return sum(1 for member in channel.members if not member.bot)
+
+
+class VoiceSessions:
+    def __init__(self, hub, idle_timeout=300, reap_interval=30, max_retry_delay=60, max_failures=8, logger=None):
+        self.hub = hub
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self.max_retry_delay = max_retry_delay
+        self.max_failures = max_failures
+        self.logger = logger
+        self.reconnects = 0
+        self._sessions = {}  # guild_id -> VoiceSession
+        self._reaper = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, guild_id):
+        return self._sessions.get(guild_id)
+
+    def start(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.ensure_future(self._reap())
+
+    # PLAYBACK
+
+    async def play(self, channel, station):
+        # Opus stations are passed through without transcoding, the codec is cached after the first probe
+        await self.hub.probe(station)
+
+        # Joins the channel, or moves there if the bot is already in another channel of the guild
+        session = self._sessions.get(channel.guild.id)
+        voice_client = channel.guild.voice_client
+        if voice_client is not None and not voice_client.is_connected():
+            # Left behind by a dropped connection, channel.connect() refuses while the guild still has it
+            await voice_client.disconnect(force=True)
+            voice_client = None
+        if voice_client is None:
+            voice_client = await channel.connect()
+        elif voice_client.channel != channel:
+            await voice_client.move_to(channel)
+
+        if session is not None:
+            self._cancel_retry(session)
+            session.stopping = True  # the old stream's after callback must not restart it
+        # Also stops audio from a client without a session, play() refuses while anything is playing
+        if voice_client.is_playing() or voice_client.is_paused():
+            voice_client.stop()
+        session = VoiceSession(channel.guild.id, channel, voice_client, station)
+        session.empty_since = None if listeners(channel) else time.monotonic()
+        self._sessions[channel.guild.id] = session
+        self._start_stream(session)
+        return session
+
+    def _start_stream(self, session):
+        loop = asyncio.get_running_loop()
+        session.started = time.monotonic()
+        session.voice_client.play(
+            self.hub.listen(session.station),
+            # Runs on the player thread once the stream ends or fails
+            after=lambda error: loop.call_soon_threadsafe(self._stream_ended, session, error)
+        )
+
+    def _stream_ended(self, session, error):
+        if session.stopping or self._sessions.get(session.guild_id) is not session:
+            return
+        # A stream that played for a while counts as healthy again
+        if time.monotonic() - session.started > self.max_retry_delay:
+            session.failures = 0
+        session.failures += 1
+        if session.failures > self.max_failures:
+            if self.logger:
+                self.logger.error(f'Giving up on radio station {session.station} in guild {session.guild_id} after {self.max_failures} attempts')
+            asyncio.ensure_future(self.stop(session.guild_id))
+            return
+        delay = min(2 ** (session.failures - 1), self.max_retry_delay)
+        if self.logger:
+            self.logger.warning(f'Radio station {session.station} stopped in guild {session.guild_id} ({error}), reconnecting in {delay}s')
+        session.retry = asyncio.get_running_loop().call_later(delay, lambda: asyncio.ensure_future(self._reconnect(session)))
+
+    async def _reconnect(self, session):
+        session.retry = None
+        if session.stopping or self._sessions.get(session.guild_id) is not session:
+            return
+        self.reconnects += 1
+        try:
+            if not session.voice_client.is_connected():
+                session.voice_client = await session.channel.connect()
+            self._start_stream(session)
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f'Failed to reconnect radio in guild {session.guild_id}: {e}')
+            self._stream_ended(session, e)
+
+    def _cancel_retry(self, session):
+        if session.retry is not None:
+            session.retry.cancel()
+            session.retry = None
+
+    async def stop(self, guild_id):
+        session = self._sessions.pop(guild_id, None)
+        if session is None:
+            return False
+        session.stopping = True
+        self._cancel_retry(session)
+        if session.voice_client.is_connected():
+            await session.voice_client.disconnect()
+        else:
+            session.voice_client.cleanup()
+        return True
+
+    # EVENTS
+
+    def voice_state_update(self, member, before, after):
+        session = self._sessions.get(member.guild.id)
+        if session is None:
+            return
+        if member.id == member.guild.me.id:
+            if after.channel is None:
+                # Disconnected by a moderator or Discord, don't try to come back
+                session.stopping = True
+                self._cancel_retry(session)
+                del self._sessions[member.guild.id]
+            elif after.channel != session.channel:
+                session.channel = after.channel
+            self._update_empty(session)
+        elif session.channel in (before.channel, after.channel) and before.channel != after.channel:
+            self._update_empty(session)
+
+    def _update_empty(self, session):
+        if listeners(session.channel):
+            session.empty_since = None
+        elif session.empty_since is None:
+            session.empty_since = time.monotonic()
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            expired = time.monotonic() - self.idle_timeout
+            for guild_id in [g for g, s in self._sessions.items() if s.empty_since is not None and s.empty_since < expired]:
+                if self.logger:
+                    self.logger.info(f'Leaving the empty voice channel in guild {guild_id}')
+                try:
+                    await self.stop(guild_id)
+                except Exception as e:
+                    if self.logger:
+                        self.logger.error(f'Failed to leave the voice channel in guild {guild_id}: {e}')
@@ -0,0 +1,87 @@
+import asyncio
+import re
+import time
+from collections import namedtuple
+
+# WELCOME MESSAGES
+#
+# Templates are parsed once when they are set, rendering a welcome message is
+# just a join over the pre-split parts.
+
+PLACEHOLDER = re.compile(r'%(user_name|user_mention|guild_name|member_count)%')
+
+
+class WelcomeTemplate:
+    def __init__(self, text):
+        self.text = text
+        # Even indexes are literal text, odd indexes are placeholder names
+        self._parts = PLACEHOLDER.split(text)
+
+    def render(self, **values):
+        parts = self._parts[:]
+        for i in range(1, len(parts), 2):
+            parts[i] = str(values.get(parts[i], ''))
+        return ''.join(parts)
+
+
+WelcomeConfig = namedtuple('WelcomeConfig', ['channel_id', 'template'])
+
+
+# JOIN BURST COALESCING
+#
+# The first join in a guild is welcomed right away. Joins that land within
+# `window` seconds after that are collected and welcomed together in one
+# message when the window closes, so a raid costs one send instead of one per
+# member.
+
+
+class JoinCoalescer:
+    def __init__(self, send, window=5.0, max_names=20, logger=None):
+        self._send = send  # async (guild_id, members, total)
+        self.window = window
+        self.max_names = max_names
+        self.logger = logger
+        self._window_ends = {}  # guild_id -> monotonic time the window closes
+        self._pending = {}  # guild_id -> [first max_names members, total joins]
+
+    def add(self, guild_id, member):
+        now = time.monotonic()
+        if len(self._window_ends) > 1000:
+            self.prune()
+
+        pending = self._pending.get(guild_id)
+        if pending is not None:
+            # Only the first few members are named, the rest are just counted
+            if len(pending[0]) < self.max_names:
+                pending[0].append(member)
+            pending[1] += 1
+            return None
+        if self._window_ends.get(guild_id, 0) > now:
+            # Inside the window of a recent welcome, batch this join
+            self._pending[guild_id] = [[member], 1]
+            return self._spawn(self._flush_later(guild_id, self._window_ends[guild_id] - now))
+        self._window_ends[guild_id] = now + self.window
+        return self._spawn(self._send(guild_id, [member], 1))
+
+    def _spawn(self, coro):
+        # Nobody awaits the sends, failures are logged here instead of as "Task exception was never retrieved"
+        task = asyncio.ensure_future(coro)
+        task.add_done_callback(self._sent)
+        return task
+
+    def _sent(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            if self.logger:
+                self.logger.error(f'Failed to send a welcome message: {task.exception()}')
+
+    async def _flush_later(self, guild_id, delay):
+        await asyncio.sleep(delay)
+        members, total = self._pending.pop(guild_id)
+        self._window_ends[guild_id] = time.monotonic() + self.window
+        await self._send(guild_id, members, total)
+
+    def prune(self):
+        # Forget windows that closed a while ago so idle guilds don't keep entries around
+        now = time.monotonic()
+        for guild_id in [g for g, ends in self._window_ends.items() if ends < now and g not in self._pending]:
+            del self._window_ends[guild_id]
@@ -0,0 +1,126 @@
+from collections import OrderedDict, deque
+
+# BANNED WORD MATCHER
+#
+# Aho-Corasick automaton over the lowercased banned word list. The list is
+# compiled once, after that every message is scanned in a single pass no
+# matter how many words are on the list.
+
+
+class BannedWordMatcher:
+    def __init__(self, words):
+        # Lowercase and dedupe once at build time instead of on every message
+        self.words = tuple(dict.fromkeys(w.lower() for w in words if w))
+
+        goto = [{}]
+        outputs = [()]
+        for word in self.words:
+            state = 0
+            for ch in word:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    outputs.append(())
+                state = nxt
+            outputs[state] = (word,)
+
+        # Breadth-first pass to build the failure links and merge outputs
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                outputs[nxt] = outputs[nxt] + outputs[fail[nxt]]
+
+        self._goto = goto
+        self._fail = fail
+        self._outputs = outputs
+
+    def __len__(self):
+        return len(self.words)
+
+    @property
+    def state_count(self):
+        return len(self._goto)
+
+    def _scan(self, text):
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        state = 0
+        for ch in text.lower():
+            nxt = goto[state].get(ch)
+            while nxt is None and state:
+                state = fail[state]
+                nxt = goto[state].get(ch)
+            state = nxt if nxt is not None else 0
+            if outputs[state]:
+                yield outputs[state]
+
+    def search(self, text):
+        # Returns the first banned word found in text, or None
+        for found in self._scan(text):
+            return found[0]
+        return None
+
+    def find_all(self, text):
+        # Returns every banned word found in text, in order of first occurrence
+        seen = {}
+        for found in self._scan(text):
+            for word in found:
+                seen.setdefault(word, None)
+        return list(seen)
+
+
+# PER-GUILD MATCHER CACHE
+#
+# LRU cache of compiled matchers keyed by guild id and list version. The size
+# is bounded by the total number of automaton states, which is what actually
+# takes up memory. Guilds without their own words share the default matcher,
+# which isn't counted against the bound.
+
+
+class MatcherCache:
+    def __init__(self, default_matcher, max_states=500000):
+        self.default = default_matcher
+        self.max_states = max_states
+        self.total_states = 0
+        self._entries = OrderedDict()  # guild_id -> (version, matcher)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, guild_id, version=None):
+        entry = self._entries.get(guild_id)
+        if entry is None or (version is not None and entry[0] != version):
+            return None
+        self._entries.move_to_end(guild_id)
+        return entry[1]
+
+    def put(self, guild_id, version, words):
+        self.invalidate(guild_id)
+        if not words:
+            matcher = self.default
+        else:
+            matcher = BannedWordMatcher(list(self.default.words) + list(words))
+            self.total_states += matcher.state_count
+        self._entries[guild_id] = (version, matcher)
+
+        # Evict the least recently used guilds until we are back under the bound
+        while self.total_states > self.max_states and len(self._entries) > 1:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            if evicted is not self.default:
+                self.total_states -= evicted.state_count
+        return matcher
+
+    def invalidate(self, guild_id):
+        entry = self._entries.pop(guild_id, None)
+        if entry is not None and entry[1] is not self.default:
+            self.total_states -= entry[1].state_count
@@ -0,0 +1,105 @@
+import asyncio
+import random
+import re
+from collections import deque, namedtuple
+
+# WORK QUESTIONS
+#
+# /work asks a math question with a known integer answer. Questions are
+# generated ahead of time into a pool, so the command only takes one, and
+# checking an answer is a regex on a short string instead of evaluating
+# whatever the user typed.
+
+Question = namedtuple('Question', ['text', 'answer', 'difficulty'])
+
+DIFFICULTIES = ('easy', 'medium', 'hard')
+# Points paid for a correct answer, by difficulty
+REWARDS = {'easy': (10, 20), 'medium': (20, 35), 'hard': (35, 50)}
+
+MAX_ANSWER_LENGTH = 24
+ANSWER = re.compile(r'(?:x\s*=\s*)?([+-]?\d{1,12})(?:\.0*)?')
+
+
+def _easy(rng):
+    a, b = rng.randint(12, 99), rng.randint(12, 99)
+    op = rng.choice('+-*')
+    if op == '*':
+        a, b = rng.randint(3, 19), rng.randint(3, 19)
+        return Question(f'What is {a} × {b}?', a * b, 'easy')
+    if op == '-':
+        return Question(f'What is {a} - {b}?', a - b, 'easy')
+    return Question(f'What is {a} + {b}?', a + b, 'easy')
+
+
+def _medium(rng):
+    # ax + b = c
+    x = rng.randint(-20, 20)
+    a = rng.choice([n for n in range(-12, 13) if n not in (0, 1)])
+    b = rng.randint(-50, 50)
+    return Question(f'Solve the equation: {_term(a)}x {_signed(b)} = {a * x + b}. What is x?', x, 'medium')
+
+
+def _hard(rng):
+    # a(x + b) = cx + d
+    x = rng.randint(-25, 25)
+    a = rng.randint(2, 12)
+    c = rng.choice([n for n in range(-9, 10) if n not in (0, a)])
+    b = rng.randint(-15, 15)
+    d = a * (x + b) - c * x
+    return Question(f'Solve the equation: {a}(x {_signed(b)}) = {_term(c)}x {_signed(d)}. What is x?', x, 'hard')
+
+
+GENERATORS = {'easy': _easy, 'medium': _medium, 'hard': _hard}
+
+
+def _term(n):
+    # Coefficient of x: 1x is x, -1x is -x
+    return {1: '', -1: '-'}.get(n, str(n))
+
+
+def _signed(n):
+    return f'+ {n}' if n >= 0 else f'- {-n}'
+
+
+def generate(difficulty, rng=random):
+    return GENERATORS[difficulty](rng)
+
+
+def parse_answer(text):
+    # The user's integer answer, or None if it isn't one. Anything long is rejected before the regex runs.
+    if len(text) > MAX_ANSWER_LENGTH:
+        return None
+    match = ANSWER.fullmatch(text.strip().lower())
+    return int(match.group(1)) if match else None
+
+
+class QuestionPool:
+    def __init__(self, size=300, refill_below=100, weights=(3, 4, 3), rng=None):
+        self.size = size
+        self.refill_below = refill_below
+        self.weights = weights  # how often each difficulty comes up, in DIFFICULTIES order
+        self.rng = rng or random.Random()
+        self._questions = deque()
+        self._refilling = False
+        self.fill()
+
+    def __len__(self):
+        return len(self._questions)
+
+    def fill(self):
+        difficulties = self.rng.choices(DIFFICULTIES, weights=self.weights, k=self.size - len(self._questions))
+        self._questions.extend(generate(difficulty, self.rng) for difficulty in difficulties)
+        self._refilling = False
+
+    def take(self):
+        if not self._questions:
+            # Only if the pool is drained faster than the event loop can refill it
+            self.fill()
+        question = self._questions.popleft()
+        if len(self._questions) < self.refill_below and not self._refilling:
+            self._refilling = True
+            asyncio.get_running_loop().call_soon(self.fill)
+        return question
+
+    def reward(self, question):
+        return self.rng.randint(*REWARDS[question.difficulty])